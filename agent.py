@@ -1,9 +1,18 @@
+import contextvars
+import functools
+import inspect
 import os
-import requests
+from collections import deque
+
+import httpx
 from dotenv import load_dotenv
 from google.adk.agent import Agent
 from google.adk.tools import FunctionTool
 
+from query_cache import ToolResultCache
+from tool_transport import ToolTransport
+import telemetry
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -13,8 +22,106 @@ QUERY_KB_URL = os.environ.get("QUERY_KB_FUNCTION_URL", "https://us-central1-YOUR
 TRANSPORT_DISRUPTION_URL = os.environ.get("TRANSPORT_DISRUPTION_FUNCTION_URL", "https://us-central1-YOUR_PROJECT.cloudfunctions.net/get_transport_disruptions")
 TRANSPORT_SCHEDULE_URL = os.environ.get("TRANSPORT_SCHEDULE_FUNCTION_URL", "https://us-central1-YOUR_PROJECT.cloudfunctions.net/get_transport_schedule")
 
+# --- Shared Tool Transport ---
+# One keep-alive connection pool for all tool calls, with per-endpoint timeouts (seconds),
+# retries with jittered backoff on 429/5xx and a circuit breaker per endpoint
+TOOL_TRANSPORT = ToolTransport(
+    timeouts={
+        QUERY_KB_URL: float(os.environ.get("QUERY_KB_TIMEOUT", "10")),
+        TRANSPORT_DISRUPTION_URL: float(os.environ.get("TRANSPORT_DISRUPTION_TIMEOUT", "20")),
+        TRANSPORT_SCHEDULE_URL: float(os.environ.get("TRANSPORT_SCHEDULE_TIMEOUT", "20")),
+    },
+    max_retries=int(os.environ.get("TOOL_MAX_RETRIES", "2")),
+)
+
+# --- Session Tool Result Cache ---
+# Seconds a tool result is reused within one session, per tool (0 disables caching for it):
+# city-service answers change rarely, disruptions and departures change by the minute
+TOOL_CACHE_TTL_SECONDS = {
+    "query_gent_knowledge_base_tool": float(os.environ.get("TOOL_CACHE_TTL_KB", "3600")),
+    "get_transport_disruptions_tool": float(os.environ.get("TOOL_CACHE_TTL_DISRUPTIONS", "60")),
+    "get_transport_schedule_tool": float(os.environ.get("TOOL_CACHE_TTL_SCHEDULE", "30")),
+}
+# Results kept per tool and session
+TOOL_CACHE_MAX_SIZE = int(os.environ.get("TOOL_CACHE_MAX_SIZE", "128"))
+
+# --- Conversation History ---
+# Earlier exchanges (user message + reply) sent to the model with each turn; older ones are dropped
+HISTORY_MAX_TURNS = int(os.environ.get("AGENT_HISTORY_MAX_TURNS", "10"))
+
+_session_cache = contextvars.ContextVar("tool_cache", default=None)
+
+class Conversation:
+    """The bounded message history of one session, in the model's {"role", "parts"} format."""
+
+    def __init__(self, max_turns=HISTORY_MAX_TURNS):
+        self.messages = deque(maxlen=2 * max(0, max_turns))
+
+    def contents(self, user_input):
+        """What the model gets for a turn: the kept history, then the new message."""
+        return [*self.messages, {"role": "user", "parts": [{"text": user_input}]}]
+
+    def record(self, user_input, reply):
+        if self.messages.maxlen:
+            self.messages.append({"role": "user", "parts": [{"text": user_input}]})
+            self.messages.append({"role": "model", "parts": [{"text": reply}]})
+
+def start_session(cache=None):
+    """Gives the current session a tool-result cache (a fresh one unless given) and returns it."""
+    if cache is None:
+        cache = ToolResultCache(TOOL_CACHE_TTL_SECONDS, TOOL_CACHE_MAX_SIZE)
+    _session_cache.set(cache)
+    return cache
+
+def cached_tool(fn):
+    """Answers repeated calls with the same (normalized) arguments from the session cache.
+
+    An identical call still in flight is waited for rather than repeated. Error results are
+    never cached.
+    """
+    tool_name = fn.__name__
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        cache = _session_cache.get()
+        if cache is None:
+            return await fn(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        result, source = await cache.get_or_call(
+            tool_name, arguments, lambda: fn(*args, **kwargs),
+            cacheable=lambda result: isinstance(result, dict) and result.get("status") != "error")
+        telemetry.count(f"agent.tool_cache_{source}")
+        return result
+    return wrapper
+
 # --- Tool Function Definitions ---
-def query_gent_knowledge_base_tool(query: str) -> dict:
+# The tools are coroutines: the ADK awaits the function calls of one model response together,
+# so "is tram 1 disrupted and when is the next one?" costs one round trip, not two
+# (python benchmarks/bench_tool_calls.py measures it against a stand-in agent).
+async def _call_tool(url, payload, service_name, unexpected_message, stage_name="tool"):
+    """Shared body of the tools: pooled async POST, errors turned into {"status": "error", ...}."""
+    try:
+        response = await TOOL_TRANSPORT.apost(url, payload, name=stage_name)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPError as e:
+        print(f"Error calling {service_name} tool: {e}")
+        try:
+            error_details = e.response.json()
+        except Exception:
+            error_details = None
+        if isinstance(error_details, dict) and "error_message" in error_details:
+            return {"status": "error", "error_message": error_details['error_message']}
+        return {"status": "error", "error_message": f"Failed to contact the {service_name} service: {str(e)}"}
+    except Exception as e:
+        print(f"Unexpected error in {service_name} tool: {e}")
+        return {"status": "error", "error_message": unexpected_message}
+
+@cached_tool
+async def query_gent_knowledge_base_tool(query: str) -> dict:
     """Queries the internal knowledge base about City of Gent services.
     Use this tool to find information about city services, regulations, opening hours, 
     waste collection schedules, permit processes, library info, etc. for Gent.
@@ -25,18 +132,11 @@ def query_gent_knowledge_base_tool(query: str) -> dict:
     Returns:
         A dictionary containing the status and the retrieved information, or an error message.
     """
-    try:
-        response = requests.post(QUERY_KB_URL, json={'query': query}, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling knowledge base tool: {e}")
-        return {"status": "error", "error_message": f"Failed to query knowledge base: {str(e)}"}
-    except Exception as e:
-        print(f"Unexpected error in knowledge base tool: {e}")
-        return {"status": "error", "error_message": "An unexpected error occurred while querying the knowledge base."}
+    return await _call_tool(QUERY_KB_URL, {'query': query}, "knowledge base",
+                            "An unexpected error occurred while querying the knowledge base.", "tool.query_kb")
 
-def get_transport_disruptions_tool(filter: str | None = None) -> dict:
+@cached_tool
+async def get_transport_disruptions_tool(filter: str | None = None) -> dict:
     """Checks for current public transport disruptions in Gent (strikes, delays, route changes) using the De Lijn API.
     Use this tool ONLY to find out if there are known PROBLEMS or ISSUES with buses or trams in Gent right now.
     Do NOT use for regular schedule times.
@@ -48,24 +148,11 @@ def get_transport_disruptions_tool(filter: str | None = None) -> dict:
         A dictionary containing the status and a list of current disruptions, or an error message.
     """
     payload = {'filter': filter} if filter else {}
-    try:
-        response = requests.post(TRANSPORT_DISRUPTION_URL, json=payload, timeout=20)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling disruptions tool: {e}")
-        try: 
-            error_details = e.response.json()
-        except: 
-            error_details = None
-        if isinstance(error_details, dict) and "error_message" in error_details: 
-            return {"status": "error", "error_message": error_details['error_message']}
-        return {"status": "error", "error_message": f"Failed to contact the transport disruption service: {str(e)}"}
-    except Exception as e:
-        print(f"Unexpected error in disruptions tool: {e}")
-        return {"status": "error", "error_message": "An unexpected error occurred while checking transport disruptions."}
+    return await _call_tool(TRANSPORT_DISRUPTION_URL, payload, "transport disruption",
+                            "An unexpected error occurred while checking transport disruptions.", "tool.disruptions")
 
-def get_transport_schedule_tool(stop_id: str | None = None, line_number: str | None = None) -> dict:
+@cached_tool
+async def get_transport_schedule_tool(stop_id: str | None = None, line_number: str | None = None) -> dict:
     """Fetches REGULAR public transport schedule information (like next departure times) for a specific stop or line in Gent using the De Lijn API.
     Use this tool for standard timetable queries. Do NOT use for disruption information.
     
@@ -83,23 +170,8 @@ def get_transport_schedule_tool(stop_id: str | None = None, line_number: str | N
         payload['line_number'] = line_number
     if not payload:
         return {"status": "error", "error_message": "You must provide either a stop_id or a line_number."}
-        
-    try:
-        response = requests.post(TRANSPORT_SCHEDULE_URL, json=payload, timeout=20)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling schedule tool: {e}")
-        try: 
-            error_details = e.response.json()
-        except: 
-            error_details = None
-        if isinstance(error_details, dict) and "error_message" in error_details: 
-            return {"status": "error", "error_message": error_details['error_message']}
-        return {"status": "error", "error_message": f"Failed to contact the transport schedule service: {str(e)}"}
-    except Exception as e:
-        print(f"Unexpected error in schedule tool: {e}")
-        return {"status": "error", "error_message": "An unexpected error occurred while fetching the transport schedule."}
+    return await _call_tool(TRANSPORT_SCHEDULE_URL, payload, "transport schedule",
+                            "An unexpected error occurred while fetching the transport schedule.", "tool.schedule")
 
 # --- Convert Python functions into ADK FunctionTool objects ---
 tool_query_kb = FunctionTool(
@@ -136,6 +208,23 @@ agent = Agent(
     tools=[tool_query_kb, tool_transport_disruptions, tool_transport_schedule]  # List all three tools
 )
 
+def stream_reply(user_input, conversation=None):
+    """Yields the agent's reply text piece by piece as the model generates it.
+
+    With a Conversation the model also sees the session's earlier messages, and the exchange
+    is added to it once the reply is complete (an abandoned reply is not).
+    """
+    contents = conversation.contents(user_input) if conversation is not None else user_input
+    reply = []
+    for chunk in agent.generate_content(contents, stream=True):
+        for part in chunk.parts or []:
+            text = getattr(part, 'text', None)
+            if text:
+                reply.append(text)
+                yield text
+    if conversation is not None:
+        conversation.record(user_input, "".join(reply))
+
 # --- Agent Interaction Loop ---
 def main():
     print("--- Gent City Assistant ---")
@@ -155,7 +244,11 @@ def main():
     
     if missing_url:
         print("\nPlease deploy the Cloud Functions and update the URLs in .env or agent.py\n")
-    
+
+    # Tool results are reused across the turns of this session (see TOOL_CACHE_TTL_SECONDS),
+    # and the model sees its recent messages (see HISTORY_MAX_TURNS)
+    tool_cache = start_session()
+    conversation = Conversation()
     while True:
         user_input = input("You: ")
         if user_input.lower() in ["exit", "quit"]:
@@ -163,16 +256,28 @@ def main():
         if not user_input:
             continue
             
+        # One trace per user turn; its ID is forwarded to the Cloud Functions on every tool call
+        telemetry.start_trace()
         try:
-            response = agent.generate_content(user_input)
-            if response and response.parts:
-                final_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
-                print(f"Agent: {final_text}")
+            replied = False
+            with telemetry.span("agent.llm_turn"):
+                for text in stream_reply(user_input, conversation):
+                    if not replied:
+                        print("Agent: ", end="")
+                        replied = True
+                    print(text, end="", flush=True)
+            if replied:
+                print()
             else:
                 print("Agent: I'm sorry, I couldn't generate a response for that.")
         except Exception as e:
+            if replied:
+                print()
             print(f"Agent Error: An error occurred during processing: {e}")
             print("Agent: I encountered an issue processing your request. Please try again.")
+        finally:
+            telemetry.finish_trace("agent_turn")
+    telemetry.log_json(message="agent session finished", event="agent_session", tool_cache=tool_cache.stats())
 
 if __name__ == "__main__":
     main()
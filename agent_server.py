@@ -0,0 +1,363 @@
+# agent_server.py (asyncio HTTP/WebSocket server hosting many Gent City Assistant sessions at once)
+#
+# Usage: python agent_server.py   (or: uvicorn agent_server:app --port 8080)
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+import agent as gent_agent
+import telemetry
+from query_cache import ToolResultCache
+
+# --- Configuration ---
+# Port to listen on (Cloud Run sets PORT)
+PORT = int(os.environ.get("PORT", "8080"))
+# Sessions kept in memory; the least recently used one is dropped beyond this
+MAX_SESSIONS = int(os.environ.get("AGENT_MAX_SESSIONS", "1000"))
+# Seconds without a message after which a session is dropped
+SESSION_IDLE_SECONDS = float(os.environ.get("AGENT_SESSION_IDLE_SECONDS", "1800"))
+# Turns generated at the same time, one worker thread each; further turns wait for a slot
+MAX_CONCURRENT_TURNS = int(os.environ.get("AGENT_MAX_CONCURRENT_TURNS", "16"))
+# Turns allowed to wait for a slot; beyond this new turns are rejected with 503 straight away
+MAX_QUEUED_TURNS = int(os.environ.get("AGENT_MAX_QUEUED_TURNS", "64"))
+# Seconds a turn may wait for a slot before it is rejected
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("AGENT_QUEUE_TIMEOUT_SECONDS", "10"))
+# Seconds new turns are refused after the model reports rate limiting (429 / resource exhausted)
+OVERLOAD_COOLDOWN_SECONDS = float(os.environ.get("AGENT_OVERLOAD_COOLDOWN_SECONDS", "5"))
+# Reply chunks buffered per turn; generation pauses while the client has this many unread
+STREAM_BUFFER_CHUNKS = max(1, int(os.environ.get("AGENT_STREAM_BUFFER_CHUNKS", "32")))
+# Seconds generation waits on a client that stopped reading before the turn is abandoned
+STREAM_STALL_SECONDS = float(os.environ.get("AGENT_STREAM_STALL_SECONDS", "30"))
+
+FALLBACK_REPLY = "I encountered an issue processing your request. Please try again."
+
+class Overloaded(Exception):
+    """A turn was not admitted; retry_after is the client's hint in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Bounds the turns in flight and the turns waiting for one, so a saturated model or
+    tool backend turns into fast 503s with Retry-After instead of an ever-growing backlog.
+    """
+
+    def __init__(self, max_concurrent, max_queued, queue_timeout, cooldown, clock=time.monotonic):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.cooldown = cooldown
+        self._clock = clock
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._cooldown_until = 0.0
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        now = self._clock()
+        if now < self._cooldown_until:
+            self.rejected += 1
+            raise Overloaded("The assistant is busy right now, please try again shortly.", self._cooldown_until - now)
+        if self._slots.locked() and self.queued >= self.max_queued:
+            self.rejected += 1
+            raise Overloaded("Too many conversations in progress, please try again shortly.", self.cooldown)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded("Timed out waiting for the assistant, please try again shortly.", self.cooldown)
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        self.admitted += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def back_off(self):
+        """Refuses new turns for the cool-down period (called when the model is rate limited)."""
+        self._cooldown_until = max(self._cooldown_until, self._clock() + self.cooldown)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "cooling_down": self._clock() < self._cooldown_until,
+        }
+
+class Session:
+    """One conversation: its own bounded history and tool-result cache, and at most one turn at a time."""
+
+    def __init__(self, session_id, now):
+        self.id = session_id
+        self.conversation = gent_agent.Conversation()
+        self.tool_cache = ToolResultCache(gent_agent.TOOL_CACHE_TTL_SECONDS, gent_agent.TOOL_CACHE_MAX_SIZE)
+        self.last_active = now
+        self.turns = 0
+        self.busy = False
+
+class SessionStore:
+    """Sessions by ID in least-recently-used order, capped at max_sessions and expired when idle."""
+
+    def __init__(self, max_sessions, idle_seconds, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._clock = clock
+        self._sessions = OrderedDict()
+        self.evictions = 0
+
+    def _expire(self, now):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_active < self.idle_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def create(self):
+        now = self._clock()
+        self._expire(now)
+        session = Session(uuid.uuid4().hex, now)
+        self._sessions[session.id] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+        return session
+
+    def get(self, session_id):
+        now = self._clock()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_active = now
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def remove(self, session_id):
+        return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+SESSIONS = SessionStore(MAX_SESSIONS, SESSION_IDLE_SECONDS)
+ADMISSION = AdmissionController(MAX_CONCURRENT_TURNS, MAX_QUEUED_TURNS, QUEUE_TIMEOUT_SECONDS, OVERLOAD_COOLDOWN_SECONDS)
+TURN_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TURNS, thread_name_prefix="agent-turn")
+
+def is_rate_limited(error):
+    """True for the model's 429 / resource-exhausted errors (matched by name, the SDK exception types vary)."""
+    text = f"{type(error).__name__} {error}"
+    return "429" in text or "ResourceExhausted" in text or "RESOURCE_EXHAUSTED" in text
+
+class Turn:
+    """One admitted turn: generated on a worker thread, consumed with events().
+
+    The worker needs a credit per chunk and the consumer returns credits once the chunks are
+    written, so a client that reads slowly pauses generation instead of buffering the whole
+    reply. The admission slot and the session are released when generation ends, also when
+    the client went away before that.
+    """
+
+    def __init__(self, session, message):
+        self.session = session
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._credits = threading.Semaphore(STREAM_BUFFER_CHUNKS)
+        self._abandoned = threading.Event()
+        session.turns += 1
+        # A fresh context per turn: the session's tool cache and a new trace, nothing left from the previous turn on this thread
+        future = self._loop.run_in_executor(TURN_EXECUTOR, contextvars.Context().run, self._generate, message)
+        future.add_done_callback(self._finished)
+
+    def _finished(self, future):
+        # On the event loop, before the final event is queued: a client that got "done" can send its next message
+        self.session.busy = False
+        ADMISSION.release()
+        error = future.exception()
+        self._queue.put_nowait(("error", error) if error is not None else future.result())
+
+    def _put_text(self, text):
+        if not self._credits.acquire(timeout=STREAM_STALL_SECONDS):
+            self._abandoned.set()
+        if self._abandoned.is_set():
+            return False
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, ("text", text))
+        return True
+
+    def _generate(self, message):
+        gent_agent.start_session(self.session.tool_cache)
+        telemetry.start_trace()
+        chunks = 0
+        try:
+            with telemetry.span("agent.llm_turn"):
+                for text in gent_agent.stream_reply(message, self.session.conversation):
+                    chunks += 1
+                    if not self._put_text(text):
+                        break
+            event = ("done", None)
+        except Exception as e:
+            print(f"Agent Error in session {self.session.id}: {e}")
+            if is_rate_limited(e):
+                ADMISSION.back_off()
+            event = ("error", e)
+        finally:
+            telemetry.finish_trace("agent_turn", session_id=self.session.id, chunks=chunks,
+                                   abandoned=self._abandoned.is_set())
+        return event # queued by _finished
+
+    async def events(self):
+        """Yields ("text", str) events, then one ("done", None) or ("error", exception)."""
+        pending = None
+        try:
+            while True:
+                kind, value = pending or await self._queue.get()
+                pending = None
+                if kind != "text":
+                    yield kind, value
+                    return
+                # Chunks that arrived while the previous write was in progress go out as one
+                texts = [value]
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item[0] != "text":
+                        pending = item
+                        break
+                    texts.append(item[1])
+                yield "text", "".join(texts)
+                self._credits.release(len(texts))
+        finally:
+            # Client gone or finished: stop generating and wake a worker waiting for credit
+            # (the session stays busy until the worker has actually stopped, see _finished)
+            self._abandoned.set()
+            self._credits.release(STREAM_BUFFER_CHUNKS)
+
+async def start_turn(session, message):
+    """Admits a turn for the session or raises Overloaded.
+
+    The session is marked busy before waiting for admission, so a second message sent
+    meanwhile is refused instead of running alongside the first.
+    """
+    session.busy = True
+    try:
+        await ADMISSION.acquire()
+    except BaseException:
+        session.busy = False
+        raise
+    return Turn(session, message)
+
+def error_response(message, status_code, retry_after=None):
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))} if retry_after is not None else None
+    return JSONResponse({"status": "error", "error_message": message}, status_code=status_code, headers=headers)
+
+# --- HTTP Endpoints ---
+async def create_session(request):
+    session = SESSIONS.create()
+    return JSONResponse({"status": "success", "session_id": session.id}, status_code=201)
+
+async def delete_session(request):
+    if not SESSIONS.remove(request.path_params["session_id"]):
+        return error_response("Unknown session.", 404)
+    return JSONResponse({"status": "success"})
+
+async def post_message(request):
+    """Streams the reply to {"message": ...} as plain text chunks while it is generated."""
+    session = SESSIONS.get(request.path_params["session_id"])
+    if session is None:
+        return error_response("Unknown or expired session.", 404)
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    message = body.get("message") if isinstance(body, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        return error_response("Missing 'message' in the request body.", 400)
+    if session.busy:
+        return error_response("A reply is still being generated for this session.", 409)
+    try:
+        turn = await start_turn(session, message)
+    except Overloaded as e:
+        return error_response(str(e), 503, e.retry_after)
+
+    async def body_chunks():
+        async with aclosing(turn.events()) as events:
+            async for kind, value in events:
+                if kind == "text":
+                    yield value
+                elif kind == "error":
+                    yield FALLBACK_REPLY
+
+    return StreamingResponse(body_chunks(), media_type="text/plain; charset=utf-8")
+
+async def server_stats(request):
+    return JSONResponse({"sessions": len(SESSIONS), "session_evictions": SESSIONS.evictions,
+                         "admission": ADMISSION.stats(), "telemetry": telemetry.snapshot()})
+
+# --- WebSocket Endpoint ---
+async def session_socket(websocket):
+    """One session per connection (or ?session_id= to resume): send text messages, receive
+    {"type": "delta"} events as the reply is generated, then {"type": "done"} or {"type": "error"}.
+    """
+    await websocket.accept()
+    session_id = websocket.query_params.get("session_id")
+    session = SESSIONS.get(session_id) if session_id else None
+    if session is None:
+        session = SESSIONS.create()
+    await websocket.send_json({"type": "session", "session_id": session.id})
+    try:
+        while True:
+            message = await websocket.receive_text()
+            if not message.strip():
+                continue
+            if SESSIONS.get(session.id) is None:
+                await websocket.send_json({"type": "error", "error_message": "Session expired."})
+                break
+            if session.busy:
+                await websocket.send_json({"type": "error", "error_message": "A reply is still being generated for this session."})
+                continue
+            try:
+                turn = await start_turn(session, message)
+            except Overloaded as e:
+                await websocket.send_json({"type": "error", "error_message": str(e), "retry_after": round(e.retry_after, 1)})
+                continue
+            async with aclosing(turn.events()) as events:
+                async for kind, value in events:
+                    if kind == "text":
+                        await websocket.send_json({"type": "delta", "text": value})
+                    elif kind == "done":
+                        await websocket.send_json({"type": "done"})
+                    else:
+                        await websocket.send_json({"type": "error", "error_message": FALLBACK_REPLY})
+    except WebSocketDisconnect:
+        pass
+
+app = Starlette(routes=[
+    Route("/sessions", create_session, methods=["POST"]),
+    Route("/sessions/{session_id}", delete_session, methods=["DELETE"]),
+    Route("/sessions/{session_id}/messages", post_message, methods=["POST"]),
+    Route("/stats", server_stats, methods=["GET"]),
+    WebSocketRoute("/ws", session_socket),
+])
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=PORT)
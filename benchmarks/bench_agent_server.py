@@ -0,0 +1,204 @@
+# benchmarks/bench_agent_server.py (how agent_server.py scales with concurrent users, against a stubbed model)
+#
+# Starts agent_server on a local port with a fake ADK agent that streams a canned reply
+# (first-token latency, then one chunk every --chunk-ms) in a subprocess, and runs N simulated
+# users per level, each holding its own session and sending --turns messages. With --tool-calls
+# every reply first calls that many of agent.py's real tools, through the shared tool transport,
+# against a local stand-in for the Cloud Functions that answers in --tool-ms (tool caching off):
+#
+#   python benchmarks/bench_agent_server.py --users 1,16,64,256 --turns 3 --max-concurrent 32
+#   python benchmarks/bench_agent_server.py --transport ws --users 64
+#   python benchmarks/bench_agent_server.py --users 32 --tool-calls 3 --tool-ms 50
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stand_ins import TOOL_CALLS, MockToolServer, install_fake_adk
+
+def percentile(values, q):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 1) if values else None
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def serve(args):
+    """Server process: fake ADK installed, then agent_server on args.port."""
+    import uvicorn
+
+    if args.tool_calls:
+        fake_agent = install_fake_adk(args.first_token_ms, args.chunk_ms, args.chunks)
+        fake_agent.tool_calls = TOOL_CALLS[:min(args.tool_calls, len(TOOL_CALLS))]
+    else:
+        install_fake_adk(args.first_token_ms, args.chunk_ms, args.chunks, args.tool_ms)
+    import agent_server
+    uvicorn.run(agent_server.app, host='127.0.0.1', port=args.port, log_level='warning', ws='websockets-sansio')
+
+def start_server(args, port, tool_server=None):
+    """Runs the server in its own process, so the load generator does not compete with it for the GIL."""
+    env = dict(os.environ, AGENT_MAX_CONCURRENT_TURNS=str(args.max_concurrent), AGENT_MAX_QUEUED_TURNS=str(args.max_queued),
+               AGENT_QUEUE_TIMEOUT_SECONDS=str(args.queue_timeout))
+    if tool_server is not None:
+        env.update(QUERY_KB_FUNCTION_URL=f"{tool_server.url}/query_gent_services_kb",
+                   TRANSPORT_DISRUPTION_FUNCTION_URL=f"{tool_server.url}/get_transport_disruptions",
+                   TRANSPORT_SCHEDULE_FUNCTION_URL=f"{tool_server.url}/get_transport_schedule",
+                   TOOL_CACHE_TTL_KB="0", TOOL_CACHE_TTL_DISRUPTIONS="0", TOOL_CACHE_TTL_SCHEDULE="0")
+    command = [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port),
+               '--first-token-ms', str(args.first_token_ms), '--chunk-ms', str(args.chunk_ms),
+               '--chunks', str(args.chunks), '--tool-ms', str(args.tool_ms), '--tool-calls', str(args.tool_calls)]
+    # Per-turn JSON log lines go nowhere; the results table is the output
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("agent_server did not start")
+
+def count(results, status):
+    results["status"][status] = results["status"].get(status, 0) + 1
+
+async def http_user(client, base, turns, think_s, results):
+    import httpx
+
+    response = await client.post(f"{base}/sessions")
+    session_id = response.json()["session_id"]
+    for i in range(turns):
+        start = time.perf_counter()
+        first = None
+        try:
+            async with client.stream("POST", f"{base}/sessions/{session_id}/messages",
+                                     json={"message": f"When is waste collection in Ledeberg? ({i})"}) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    count(results, str(response.status_code))
+                    continue
+                async for _ in response.aiter_text():
+                    if first is None:
+                        first = time.perf_counter()
+        except httpx.HTTPError as e:
+            count(results, type(e).__name__)
+            continue
+        count(results, "200")
+        results["ttfb_ms"].append((first - start) * 1000)
+        results["turn_ms"].append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(think_s)
+
+async def ws_user(client, base, turns, think_s, results):
+    import websockets
+
+    async with websockets.connect(base.replace("http", "ws", 1) + "/ws") as socket_:
+        json.loads(await socket_.recv())
+        for i in range(turns):
+            start = time.perf_counter()
+            first = None
+            await socket_.send(f"When is waste collection in Ledeberg? ({i})")
+            while True:
+                event = json.loads(await socket_.recv())
+                if event["type"] == "delta" and first is None:
+                    first = time.perf_counter()
+                if event["type"] != "delta":
+                    break
+            count(results, "200" if event["type"] == "done" else "error")
+            if event["type"] == "done":
+                results["ttfb_ms"].append((first - start) * 1000)
+                results["turn_ms"].append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(think_s)
+
+async def run_level(base, users, args):
+    import httpx
+
+    results = {"status": {}, "ttfb_ms": [], "turn_ms": []}
+    user = ws_user if args.transport == 'ws' else http_user
+    # One client (connection) per user, like separate browsers: a shared httpx pool serializes
+    # on its lock at this concurrency. Created before the clock starts, they are not cheap.
+    clients = [httpx.AsyncClient(timeout=120) for _ in range(users)]
+    start = time.perf_counter()
+    await asyncio.gather(*(user(client, base, args.turns, args.think_ms / 1000.0, results) for client in clients))
+    elapsed = time.perf_counter() - start
+    stats = (await clients[0].get(f"{base}/stats")).json()
+    for client in clients:
+        await client.aclose()
+    completed = results["status"].get("200", 0)
+    return {
+        "users": users,
+        "turns_completed": completed,
+        "turns_rejected": sum(n for status, n in results["status"].items() if status != "200"),
+        "statuses": results["status"],
+        "turns_per_s": round(completed / elapsed, 1),
+        "ttfb_p50_ms": percentile(results["ttfb_ms"], 0.50),
+        "ttfb_p95_ms": percentile(results["ttfb_ms"], 0.95),
+        "turn_p50_ms": percentile(results["turn_ms"], 0.50),
+        "turn_p95_ms": percentile(results["turn_ms"], 0.95),
+        "sessions": stats["sessions"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the multi-session agent server with a stubbed model")
+    parser.add_argument('--users', default='1,8,32,128', help="comma-separated concurrent user counts")
+    parser.add_argument('--turns', type=int, default=3, help="messages per user")
+    parser.add_argument('--think-ms', type=float, default=0.0, help="pause between a user's messages")
+    parser.add_argument('--transport', choices=['http', 'ws'], default='http')
+    parser.add_argument('--first-token-ms', type=float, default=300.0, help="fake model latency before the first chunk")
+    parser.add_argument('--chunk-ms', type=float, default=20.0, help="fake model latency between chunks")
+    parser.add_argument('--chunks', type=int, default=20, help="chunks per reply")
+    parser.add_argument('--tool-ms', type=float, default=0.0,
+                        help="latency of each tool call, or with no --tool-calls extra latency before the first chunk")
+    parser.add_argument('--tool-calls', type=int, default=0, help="real tool calls per reply, made together")
+    parser.add_argument('--max-concurrent', type=int, default=32, help="AGENT_MAX_CONCURRENT_TURNS")
+    parser.add_argument('--max-queued', type=int, default=64, help="AGENT_MAX_QUEUED_TURNS")
+    parser.add_argument('--queue-timeout', type=float, default=10.0, help="AGENT_QUEUE_TIMEOUT_SECONDS")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args)
+
+    # The tool stand-in runs here, so its request and connection counts can be reported
+    tool_server = MockToolServer(latency_ms=args.tool_ms).start() if args.tool_calls else None
+    port = free_port()
+    server = start_server(args, port, tool_server)
+    base = f"http://127.0.0.1:{port}"
+    ideal_ms = args.first_token_ms + args.tool_ms + args.chunk_ms * (args.chunks - 1)
+    tools = f", {args.tool_calls} tool calls" if args.tool_calls else ""
+    print(f"Fake model: {ideal_ms:.0f} ms per reply ({args.first_token_ms + args.tool_ms:.0f} ms to first chunk{tools}); "
+          f"{args.max_concurrent} concurrent turns, {args.max_queued} queued; transport {args.transport}")
+    print(f"{'users':>6}{'done':>7}{'refused':>9}{'turns/s':>9}{'ttfb p50':>10}{'ttfb p95':>10}{'turn p50':>10}{'turn p95':>10}"
+          + (f"{'tool reqs':>11}{'tool conns':>12}" if tool_server else ""))
+    levels = []
+    try:
+        for users in (int(u) for u in args.users.split(',')):
+            if tool_server:
+                requests, connections = len(tool_server.intervals), tool_server.connections
+            level = asyncio.run(run_level(base, users, args))
+            if tool_server:
+                level["tool_requests"] = len(tool_server.intervals) - requests
+                level["tool_connections"] = tool_server.connections - connections
+            levels.append(level)
+            print(f"{users:>6}{level['turns_completed']:>7}{level['turns_rejected']:>9}{level['turns_per_s']:>9}"
+                  f"{level['ttfb_p50_ms']:>10}{level['ttfb_p95_ms']:>10}{level['turn_p50_ms']:>10}{level['turn_p95_ms']:>10}"
+                  + (f"{level['tool_requests']:>11}{level['tool_connections']:>12}" if tool_server else ""))
+    finally:
+        server.terminate()
+        server.wait()
+        if tool_server:
+            tool_server.stop()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"config": vars(args), "levels": levels}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
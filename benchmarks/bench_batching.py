@@ -0,0 +1,68 @@
+# benchmarks/bench_batching.py (throughput of coalesced vs per-request query embeddings)
+#
+# Usage: python benchmarks/bench_batching.py --threads 32 --requests 2000 --call-ms 40 --window-ms 5
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from embedding_batcher import EmbeddingBatcher
+
+class StubEmbeddingModel:
+    """Stands in for TextEmbeddingModel: fixed latency per call plus a small per-item cost,
+    and at most max_in_flight concurrent calls (like a per-instance quota)."""
+
+    def __init__(self, call_ms, item_ms, max_in_flight):
+        self.call_seconds = call_ms / 1000.0
+        self.item_seconds = item_ms / 1000.0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self.calls = 0
+
+    def get_embeddings(self, texts):
+        with self._slots:
+            self.calls += 1
+            time.sleep(self.call_seconds + self.item_seconds * len(texts))
+            return [[float(len(t)), 1.0] for t in texts]
+
+def run(label, embed_one, threads, n_requests, model):
+    latencies = []
+    def one(i):
+        start = time.perf_counter()
+        embed_one(f"question {i}")
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(n_requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f"{label:<12}{n_requests / elapsed:>12.1f}{p50:>10.1f}{p95:>10.1f}{model.calls:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of micro-batched vs single query embedding calls")
+    parser.add_argument('--threads', type=int, default=32, help="concurrent in-flight requests")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--call-ms', type=float, default=40.0, help="stub model latency per call")
+    parser.add_argument('--item-ms', type=float, default=0.5, help="stub model latency per text")
+    parser.add_argument('--max-in-flight', type=int, default=8, help="concurrent calls the stub model accepts")
+    parser.add_argument('--window-ms', type=float, default=5.0)
+    parser.add_argument('--batch-size', type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"threads={args.threads} requests={args.requests} call={args.call_ms}ms window={args.window_ms}ms")
+    print(f"{'mode':<12}{'req/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'calls':>8}")
+    model = StubEmbeddingModel(args.call_ms, args.item_ms, args.max_in_flight)
+    run("single", lambda text: model.get_embeddings([text])[0], args.threads, args.requests, model)
+
+    model = StubEmbeddingModel(args.call_ms, args.item_ms, args.max_in_flight)
+    batcher = EmbeddingBatcher(model.get_embeddings, max_batch_size=args.batch_size, max_wait_ms=args.window_ms,
+                               max_in_flight=args.max_in_flight)
+    run("batched", batcher.embed, args.threads, args.requests, model)
+    print(f"batcher: {batcher.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# benchmarks/bench_doc_store.py (memory per document of the columnar store, and int8 accuracy vs size)
+#
+# Usage: python benchmarks/bench_doc_store.py --docs 20000 --dim 768 --queries 200
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ingestion import index_documents, split_into_passages
+from lexical_index import BM25Index
+from retrieval_index import ExactIndex, Int8ExactIndex
+from bench_index import synthetic_corpus
+from stand_ins import FakeTextEmbeddingModel, synthetic_document, synthetic_queries
+
+def traced_bytes(build):
+    """Bytes still allocated by the object build() returns (tracemalloc)."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+def build_passages(documents):
+    """The previous passage layout, for comparison: one dict per passage of the documents."""
+    passages = []
+    for doc_index, doc in enumerate(documents):
+        for passage_index, chunk in enumerate(split_into_passages(doc['content'])):
+            passages.append({
+                "doc_index": doc_index,
+                "passage_index": passage_index,
+                "title": doc.get('title', 'Unknown Title'),
+                "text": chunk,
+            })
+    return passages
+
+def memory_report(n_docs, dim):
+    rng = random.Random(42)
+    documents = [synthetic_document(i, rng) for i in range(n_docs)]
+    text_bytes = sum(len(d['content'].encode('utf-8')) for d in documents)
+
+    # Previous layout: parsed document dicts, a dict per passage and SDK-style lists of Python floats
+    serialized = json.dumps(documents)
+    old_docs, old_docs_bytes = traced_bytes(lambda: json.loads(serialized))
+    old_passages, old_passages_bytes = traced_bytes(lambda: build_passages(old_docs))
+    sample = min(n_docs, 200)
+    _, float_lists_bytes = traced_bytes(lambda: [[float(x) for x in np.random.default_rng(i).standard_normal(dim)] for i in range(sample)])
+    float_lists_bytes = float_lists_bytes * n_docs / sample
+
+    (_, store), store_bytes = traced_bytes(lambda: index_documents(iter(documents)))
+    _, bm25_bytes = traced_bytes(lambda: BM25Index(store.texts, titles=store.passage_titles()))
+    float32_bytes = len(store) * dim * 4
+    int8_bytes = len(store) * (dim + 4)
+
+    rows = [
+        ("documents + passages (dicts)", old_docs_bytes + old_passages_bytes),
+        ("DocumentTable + PassageStore", store_bytes),
+        ("vectors as Python float lists", float_lists_bytes),
+        ("vectors float32 matrix", float32_bytes),
+        ("vectors int8 + scale", int8_bytes),
+        ("BM25 postings", bm25_bytes),
+    ]
+    print(f"Memory per document ({n_docs} docs, {len(store)} passages, dim={dim}, {text_bytes / n_docs:.0f} B of UTF-8 content per doc)")
+    print(f"{'layout':<34}{'bytes/doc':>12}{'total MiB':>12}")
+    for name, total in rows:
+        print(f"{name:<34}{total / n_docs:>12.0f}{total / 2**20:>12.1f}")
+
+def accuracy_report(label, matrix, queries, k):
+    exact = ExactIndex(matrix)
+    quantized = Int8ExactIndex.from_matrix(matrix)
+    recalls, top1, errors, exact_ms, int8_ms = [], [], [], [], []
+    for q in queries:
+        start = time.perf_counter()
+        truth = exact.search(q, k)
+        exact_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        approx = quantized.search(q, k)
+        int8_ms.append((time.perf_counter() - start) * 1000)
+        # Tie-aware: a result counts if its exact score reaches the k-th best exact score
+        # (templated documents often score exactly the same)
+        exact_scores = matrix @ (np.asarray(q, dtype=np.float32) / np.linalg.norm(q))
+        kth, best = truth[-1][1] - 1e-6, truth[0][1] - 1e-6
+        recalls.append(sum(exact_scores[i] >= kth for i, _ in approx) / len(truth))
+        top1.append(exact_scores[approx[0][0]] >= best)
+        errors.extend(abs(float(exact_scores[i]) - score) for i, score in approx)
+    print(f"{label:<22}{np.mean(recalls):>10.4f}{np.mean(top1):>8.3f}{np.mean(errors):>12.5f}{np.max(errors):>12.5f}"
+          f"{np.percentile(exact_ms, 50):>10.3f}{np.percentile(int8_ms, 50):>10.3f}"
+          f"{matrix.nbytes / 2**20:>10.1f}{quantized.nbytes() / 2**20:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory footprint of the columnar doc store and int8 accuracy vs size")
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    memory_report(args.docs, args.dim)
+
+    print(f"\nint8 vs float32 exact search (k={args.k}, {args.queries} queries)")
+    print(f"{'corpus':<22}{'recall@k':>10}{'top-1':>8}{'mean |err|':>12}{'max |err|':>12}"
+          f"{'f32 ms':>10}{'int8 ms':>10}{'f32 MiB':>10}{'int8 MiB':>9}")
+    rng = np.random.default_rng(42)
+    matrix = synthetic_corpus(args.docs, args.dim, max(10, args.docs // 500), rng)
+    queries = matrix[rng.integers(0, args.docs, size=args.queries)] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    accuracy_report("clustered gaussian", matrix, queries, args.k)
+
+    FakeTextEmbeddingModel.dim = args.dim
+    model = FakeTextEmbeddingModel()
+    doc_rng = random.Random(42)
+    texts = [synthetic_document(i, doc_rng)['content'] for i in range(args.docs)]
+    matrix = np.asarray([e.values for e in model.get_embeddings(texts)], dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    queries = [e.values for e in model.get_embeddings(synthetic_queries(args.queries))]
+    accuracy_report("synthetic KB (fake)", matrix, queries, args.k)
+
+if __name__ == "__main__":
+    main()
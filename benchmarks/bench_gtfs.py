@@ -0,0 +1,65 @@
+# benchmarks/bench_gtfs.py (next-departure lookup latency of the offline GTFS timetable)
+#
+# Usage: python benchmarks/bench_gtfs.py                       # synthetic feed sized like De Lijn's
+#        python benchmarks/bench_gtfs.py --timetable data/gtfs_timetable
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gtfs_timetable import GTFSTimetable
+
+def synthetic_timetable(n_stops, n_departures, n_trips, n_routes, n_services, rng):
+    """Random feed with the array sizes of a full regional GTFS feed."""
+    dep_stops = rng.integers(0, n_stops, size=n_departures, dtype=np.int32)
+    dep_times = rng.integers(5 * 3600, 25 * 3600, size=n_departures, dtype=np.int32)
+    dep_trips = rng.integers(0, n_trips, size=n_departures, dtype=np.int32)
+    order = np.lexsort((dep_times, dep_stops))
+    stop_offsets = np.zeros(n_stops + 1, dtype=np.int64)
+    np.cumsum(np.bincount(dep_stops, minlength=n_stops), out=stop_offsets[1:])
+    return GTFSTimetable(
+        [str(200000 + i) for i in range(n_stops)], [f"Stop {i}" for i in range(n_stops)],
+        np.zeros(n_stops, dtype=np.float32), np.zeros(n_stops, dtype=np.float32),
+        [str(i) for i in range(n_routes)], rng.integers(0, n_routes, size=n_trips, dtype=np.int32),
+        rng.integers(0, n_services, size=n_trips, dtype=np.int32), np.zeros(n_trips, dtype=np.int32), ["Gent"],
+        stop_offsets, dep_times[order], dep_trips[order], [f"S{i}" for i in range(n_services)],
+        rng.integers(0, 128, size=n_services, dtype=np.uint8), np.full(n_services, 20260101, dtype=np.int32),
+        np.full(n_services, 20271231, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+        np.zeros(0, dtype=np.int8))
+
+def main():
+    parser = argparse.ArgumentParser(description="Next-departure lookup latency of the offline GTFS timetable")
+    parser.add_argument('--timetable', help="directory written by 'python gtfs_timetable.py build'")
+    parser.add_argument('--stops', type=int, default=35000)
+    parser.add_argument('--departures', type=int, default=12000000)
+    parser.add_argument('--trips', type=int, default=400000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    start = time.perf_counter()
+    if args.timetable:
+        timetable = GTFSTimetable.load(args.timetable)
+    else:
+        timetable = synthetic_timetable(args.stops, args.departures, args.trips, 800, 300, rng)
+    print(f"stops={len(timetable.stop_ids)} departures={len(timetable.dep_times)} "
+          f"arrays={timetable.memory_bytes() / 1e6:.1f} MB load/build={time.perf_counter() - start:.1f}s")
+
+    stop_ids = [timetable.stop_ids[i] for i in rng.integers(0, len(timetable.stop_ids), size=args.lookups)]
+    times = rng.integers(6 * 3600, 23 * 3600, size=args.lookups)
+    base = datetime.datetime(2026, 10, 19)
+    latencies = np.empty(args.lookups)
+    for i, (stop_id, seconds) in enumerate(zip(stop_ids, times)):
+        when = base + datetime.timedelta(seconds=int(seconds))
+        t0 = time.perf_counter()
+        timetable.next_departures(stop_id, when, limit=5)
+        latencies[i] = (time.perf_counter() - t0) * 1000
+    print(f"next_departures: p50={np.percentile(latencies, 50):.4f} ms p95={np.percentile(latencies, 95):.4f} ms "
+          f"p99={np.percentile(latencies, 99):.4f} ms")
+
+if __name__ == "__main__":
+    main()
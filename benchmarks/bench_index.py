@@ -0,0 +1,60 @@
+# benchmarks/bench_index.py (recall@k vs latency of IVF against exact search)
+#
+# Usage: python benchmarks/bench_index.py --docs 200000 --dim 768 --queries 200
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from retrieval_index import ExactIndex, IVFIndex
+
+def synthetic_corpus(n_docs, dim, n_topics, rng):
+    """Clustered unit vectors, a rough stand-in for embeddings of topical documents."""
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    matrix = topics[rng.integers(0, n_topics, size=n_docs)] + 0.6 * rng.standard_normal((n_docs, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+def timed_search(index, queries, k, **kwargs):
+    results, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append([i for i, _ in index.search(q, k, **kwargs)])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.array(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k and latency of the IVF index against exact search")
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--lists', type=int, default=None, help="IVF lists (default sqrt(docs))")
+    parser.add_argument('--probes', type=str, default="1,4,8,16,32")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    matrix = synthetic_corpus(args.docs, args.dim, max(10, args.docs // 500), rng)
+    # Queries are perturbed corpus rows so every query has genuine near neighbours
+    queries = matrix[rng.integers(0, args.docs, size=args.queries)] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    exact = ExactIndex(matrix)
+    truth, exact_ms = timed_search(exact, queries, args.k)
+    print(f"docs={args.docs} dim={args.dim} queries={args.queries} k={args.k}")
+    print(f"{'backend':<16}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{'exact':<16}{1.0:>10.3f}{np.percentile(exact_ms, 50):>10.3f}{np.percentile(exact_ms, 95):>10.3f}")
+
+    start = time.perf_counter()
+    ivf = IVFIndex.build(matrix, n_lists=args.lists)
+    print(f"(IVF build: {ivf.centroids.shape[0]} lists in {time.perf_counter() - start:.1f}s)")
+    for n_probe in [int(p) for p in args.probes.split(',')]:
+        found, ivf_ms = timed_search(ivf, queries, args.k, n_probe=n_probe)
+        recall = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+        label = f"ivf probe={n_probe}"
+        print(f"{label:<16}{recall:>10.3f}{np.percentile(ivf_ms, 50):>10.3f}{np.percentile(ivf_ms, 95):>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+# benchmarks/bench_suite.py (offline end-to-end benchmark of the three Cloud Functions)
+#
+# Runs query_gent_services_kb, get_transport_disruptions and get_transport_schedule in-process
+# through functions_framework test clients, against a fake embedding model and a mock De Lijn
+# server, and writes a JSON report that can be compared between commits:
+#
+#   python benchmarks/bench_suite.py --sizes 100,1000,10000 --output bench_report.json
+#   python benchmarks/bench_suite.py --sizes 100,1000,10000 --compare bench_report.json
+#
+# Every scenario runs in a fresh subprocess so cold start and peak RSS are measured per scenario.
+# For 1M documents pass a smaller --dim (e.g. 256); at 768 dimensions the vectors alone take ~3 GB.
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stand_ins import MockDeLijnServer, install_fake_vertex, synthetic_queries, write_synthetic_kb
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024, 1)
+
+def load_test(app, requests, concurrency):
+    """Sends (path, json) POST requests from `concurrency` threads, one test client per thread."""
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    payload_bytes = []
+    lock = threading.Lock()
+
+    def one(item):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        path, payload = item
+        start = time.perf_counter()
+        response = client.post(path, json=payload)
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            payload_bytes.append(len(response.get_data()))
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        return response
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, requests))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(requests),
+        "concurrency": concurrency,
+        "throughput_rps": round(len(requests) / elapsed, 1),
+        "latency_ms": {name: round(percentile(latencies, q), 3) for name, q in
+                       (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))},
+        "status_codes": statuses,
+        # Response size is what a tool call adds to the model's context (~4 bytes per token)
+        "payload_bytes_mean": round(sum(payload_bytes) / len(payload_bytes), 1) if payload_bytes else None,
+    }
+
+# --- Scenario workers (run in a subprocess, print one JSON object) ---
+def worker_rag(args):
+    fake_model = install_fake_vertex(dim=args.dim, call_ms=args.embed_ms, item_ms=args.embed_item_ms)
+    import functions_framework
+
+    start = time.perf_counter()
+    app = functions_framework.create_app(target='query_gent_services_kb', source=os.path.join(REPO_DIR, 'main_rag.py'))
+    cold_start = time.perf_counter() - start
+    rag = sys.modules['main_rag']
+    # With background init the function serves lexically before the vectors are ready; measure both
+    rag.VECTORS_READY.wait()
+    vectors_ready = time.perf_counter() - start
+    init_calls = fake_model.calls
+    rss_after_init = peak_rss_mb()
+
+    requests = [('/', {"query": query}) for query in synthetic_queries(args.requests, seed=args.seed)]
+    result = load_test(app, requests, args.concurrency)
+    result.update({
+        "docs": args.docs,
+        "passages": len(rag.PASSAGES),
+        "cold_start_s": round(cold_start, 3),
+        "vectors_ready_s": round(vectors_ready, 3),
+        "init_embedding_calls": init_calls,
+        "query_embedding_calls": fake_model.calls - init_calls,
+        "peak_rss_after_init_mb": rss_after_init,
+        "peak_rss_mb": peak_rss_mb(),
+        "caches": {name: stats for name, stats in rag.cache_stats().items() if name != "telemetry"},
+    })
+    return result
+
+def worker_transport(args):
+    import functions_framework
+
+    source = os.path.join(REPO_DIR, 'main_transport.py')
+    start = time.perf_counter()
+    disruptions_app = functions_framework.create_app(target='get_transport_disruptions', source=source)
+    cold_start = time.perf_counter() - start
+    transport = sys.modules['main_transport']
+    schedule_app = functions_framework.create_app(target='get_transport_schedule', source=source)
+
+    lines = [str(1 + i % 12) for i in range(args.requests)]
+    disruptions = load_test(disruptions_app, [('/', {"filter": f"line {line}"}) for line in lines], args.concurrency)
+    schedule = load_test(schedule_app, [('/', {"stop_id": "200144", "line_number": line, "realtime": True}) for line in lines],
+                         args.concurrency)
+    return {
+        "cold_start_s": round(cold_start, 3),
+        "disruptions": disruptions,
+        "schedule": schedule,
+        "disruption_cache": transport.DISRUPTION_CACHE.stats(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_worker(scenario, args, env):
+    """Runs one scenario in a fresh interpreter and returns its JSON result."""
+    command = [sys.executable, os.path.abspath(__file__), '--worker', scenario,
+               '--requests', str(args.requests), '--concurrency', str(args.concurrency), '--dim', str(args.dim),
+               '--embed-ms', str(args.embed_ms), '--embed-item-ms', str(args.embed_item_ms), '--seed', str(args.seed),
+               '--docs', str(env.get('BENCH_DOCS', 0))]
+    completed = subprocess.run(command, env={**os.environ, **env}, capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(completed.stdout[-2000:], completed.stderr[-4000:], file=sys.stderr)
+        raise RuntimeError(f"Scenario {scenario} failed with exit code {completed.returncode}")
+    # Functions log to stdout; the result is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline):
+    """Prints relative changes of the headline metrics against an earlier report."""
+    def line(label, new, old, lower_is_better=True):
+        if new is None or old in (None, 0):
+            return
+        change = (new - old) / old * 100
+        better = change < 0 if lower_is_better else change > 0
+        print(f"  {label:<44}{old:>12.3f}{new:>12.3f}{change:>+9.1f}% {'better' if better else 'worse'}")
+
+    print(f"Compared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    old_rag = {run['docs']: run for run in baseline.get('rag', [])}
+    for run in report.get('rag', []):
+        old = old_rag.get(run['docs'])
+        if old is None:
+            continue
+        prefix = f"rag[{run['docs']} docs]"
+        line(f"{prefix} throughput_rps", run['throughput_rps'], old['throughput_rps'], lower_is_better=False)
+        line(f"{prefix} p95 ms", run['latency_ms']['p95'], old['latency_ms']['p95'])
+        line(f"{prefix} p99 ms", run['latency_ms']['p99'], old['latency_ms']['p99'])
+        line(f"{prefix} cold_start_s", run['cold_start_s'], old['cold_start_s'])
+        line(f"{prefix} vectors_ready_s", run.get('vectors_ready_s'), old.get('vectors_ready_s'))
+        line(f"{prefix} peak_rss_mb", run['peak_rss_mb'], old['peak_rss_mb'])
+        line(f"{prefix} payload_bytes_mean", run.get('payload_bytes_mean'), old.get('payload_bytes_mean'))
+    new_transport, old_transport = report.get('transport'), baseline.get('transport')
+    if new_transport and old_transport:
+        for name in ('disruptions', 'schedule'):
+            line(f"transport.{name} throughput_rps", new_transport[name]['throughput_rps'],
+                 old_transport[name]['throughput_rps'], lower_is_better=False)
+            line(f"transport.{name} p95 ms", new_transport[name]['latency_ms']['p95'], old_transport[name]['latency_ms']['p95'])
+            line(f"transport.{name} payload_bytes_mean", new_transport[name].get('payload_bytes_mean'),
+                 old_transport[name].get('payload_bytes_mean'))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the RAG and transport Cloud Functions")
+    parser.add_argument('--sizes', default='100,1000,10000', help="comma-separated synthetic KB sizes (documents)")
+    parser.add_argument('--requests', type=int, default=500, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--dim', type=int, default=768, help="fake embedding dimension")
+    parser.add_argument('--embed-ms', type=float, default=20.0, help="fake model latency per call")
+    parser.add_argument('--embed-item-ms', type=float, default=0.2, help="fake model latency per text")
+    parser.add_argument('--delijn-latency-ms', type=float, default=80.0)
+    parser.add_argument('--delijn-jitter-ms', type=float, default=40.0)
+    parser.add_argument('--delijn-error-rate', type=float, default=0.02)
+    parser.add_argument('--kb-format', choices=['json', 'jsonl'], default='json', help="synthetic KB file format")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-rag', action='store_true')
+    parser.add_argument('--skip-transport', action='store_true')
+    parser.add_argument('--work-dir', help="where synthetic KBs are kept (reused between runs)")
+    parser.add_argument('--output', default='bench_report.json')
+    parser.add_argument('--compare', help="earlier report to compare against")
+    parser.add_argument('--worker', choices=['rag', 'transport'], help=argparse.SUPPRESS)
+    parser.add_argument('--docs', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = worker_rag(args) if args.worker == 'rag' else worker_transport(args)
+        print(json.dumps(result))
+        return
+
+    work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), 'gent_bench')
+    os.makedirs(work_dir, exist_ok=True)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ('worker', 'docs', 'compare', 'output')},
+        },
+        "rag": [],
+    }
+
+    if not args.skip_rag:
+        for n_docs in [int(size) for size in args.sizes.split(',') if size.strip()]:
+            kb_path = os.path.join(work_dir, f'kb_{n_docs}.{args.kb_format}')
+            if not os.path.exists(kb_path):
+                write_synthetic_kb(kb_path, n_docs)
+            cache_dir = tempfile.mkdtemp(dir=work_dir)
+            env = {'KB_DATA_PATH': kb_path, 'EMBEDDING_CACHE_DIR': cache_dir, 'EMBEDDING_CACHE_WRITE': 'true',
+                   'BENCH_DOCS': str(n_docs)}
+            try:
+                # The first run embeds everything and writes the cache, the second is a cached cold start
+                uncached = run_worker('rag', args, env)
+                cached = run_worker('rag', args, env)
+            finally:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            cached["cold_start_uncached_s"] = uncached["cold_start_s"]
+            cached["vectors_ready_uncached_s"] = uncached["vectors_ready_s"]
+            cached["peak_rss_uncached_mb"] = uncached["peak_rss_mb"]
+            report["rag"].append(cached)
+            print(f"rag {n_docs:>8} docs: {cached['throughput_rps']:>8.1f} req/s  p95 {cached['latency_ms']['p95']:>8.2f} ms  "
+                  f"cold start {cached['cold_start_s']:.2f}s, vectors ready {cached['vectors_ready_s']:.2f}s "
+                  f"(uncached {uncached['vectors_ready_s']:.2f}s)  "
+                  f"peak RSS {cached['peak_rss_mb']} MB")
+
+    if not args.skip_transport:
+        with MockDeLijnServer(args.delijn_latency_ms, args.delijn_jitter_ms, args.delijn_error_rate, seed=args.seed) as mock:
+            env = {
+                'DE_LIJN_API_BASE_URL': mock.url,
+                'DE_LIJN_API_KEY': 'bench',
+                'GTFS_TIMETABLE_DIR': os.path.join(work_dir, 'no_timetable'),
+                'GTFS_STOPS_PATH': os.path.join(work_dir, 'no_stops.txt'),
+            }
+            report["transport"] = run_worker('transport', args, env)
+            report["transport"]["mock_delijn"] = {"requests": mock.requests, "errors": mock.errors}
+        for name in ('disruptions', 'schedule'):
+            run = report["transport"][name]
+            print(f"transport.{name:<12} {run['throughput_rps']:>8.1f} req/s  p95 {run['latency_ms']['p95']:>8.2f} ms  "
+                  f"status {run['status_codes']}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
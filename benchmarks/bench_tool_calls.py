@@ -0,0 +1,69 @@
+# benchmarks/bench_tool_calls.py (do the tool calls of one model response overlap?)
+#
+# Runs agent.py's real tools against a local stand-in for the Cloud Functions (each call takes
+# --tool-ms), with a stand-in agent that asks for --calls different tool calls in one response
+# and dispatches them like the ADK: awaited together, then one after the other for comparison.
+# Each turn runs on its own event loop, as in agent.stream_reply; the connections column counts
+# the TCP connections the stand-in accepted, which stays at the pool size when they are reused.
+# Then --load-turns turns run on --threads threads to measure throughput. With --duplicate the
+# response also repeats its first call, which should not add a request (see cached_tool).
+#
+#   python benchmarks/bench_tool_calls.py --calls 3 --tool-ms 200
+#   python benchmarks/bench_tool_calls.py --tool-ms 5 --load-turns 200 --threads 8
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stand_ins import TOOL_CALLS, MockToolServer, install_fake_adk
+
+def run_turn(gent_agent, parallel):
+    gent_agent.agent.parallel_tools = parallel
+    gent_agent.start_session() # A fresh tool cache, so every call goes out
+    start = time.perf_counter()
+    "".join(gent_agent.stream_reply("Is tram 1 running and when does it leave?"))
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks that the tool calls of one model response run concurrently")
+    parser.add_argument('--calls', type=int, default=3, help=f"tool calls in the response (at most {len(TOOL_CALLS)})")
+    parser.add_argument('--tool-ms', type=float, default=200.0, help="latency of each tool function")
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--duplicate', action='store_true', help="repeat the first tool call in the response")
+    parser.add_argument('--load-turns', type=int, default=200, help="turns in the throughput run (0 to skip)")
+    parser.add_argument('--threads', type=int, default=8, help="threads running turns in the throughput run")
+    args = parser.parse_args()
+
+    with MockToolServer(latency_ms=args.tool_ms) as server:
+        os.environ.update(QUERY_KB_FUNCTION_URL=f"{server.url}/query_gent_services_kb",
+                          TRANSPORT_DISRUPTION_FUNCTION_URL=f"{server.url}/get_transport_disruptions",
+                          TRANSPORT_SCHEDULE_FUNCTION_URL=f"{server.url}/get_transport_schedule")
+        fake_agent = install_fake_adk(first_token_ms=0.0, chunk_ms=0.0, chunks=1)
+        fake_agent.tool_calls = TOOL_CALLS[:max(1, min(args.calls, len(TOOL_CALLS)))]
+        if args.duplicate:
+            fake_agent.tool_calls.append(fake_agent.tool_calls[0])
+        import agent as gent_agent
+
+        print(f"{len(fake_agent.tool_calls)} tool calls per response, {args.tool_ms:.0f} ms each")
+        print(f"{'dispatch':<12}{'turn p50 ms':>13}{'peak overlap':>14}{'requests':>10}{'connections':>13}")
+        for label, parallel in (("together", True), ("sequential", False)):
+            server.intervals.clear()
+            opened = server.connections
+            times = sorted(run_turn(gent_agent, parallel) for _ in range(args.turns))
+            print(f"{label:<12}{times[len(times) // 2]:>13.1f}{server.peak_concurrency():>14}"
+                  f"{len(server.intervals):>10}{server.connections - opened:>13}")
+
+        if args.load_turns > 0:
+            opened = server.connections
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.threads) as pool:
+                list(pool.map(lambda _: run_turn(gent_agent, True), range(args.load_turns)))
+            elapsed = time.perf_counter() - start
+            print(f"{args.load_turns} turns on {args.threads} threads: {args.load_turns / elapsed:.1f} turns/s, "
+                  f"{server.connections - opened} new connections")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+# benchmarks/stand_ins.py (deterministic local stand-ins for Vertex AI, the ADK, the De Lijn API and the tool functions)
+import asyncio
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import types
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+_WORD = re.compile(r'\w+')
+
+class FakeEmbedding:
+    def __init__(self, values):
+        self.values = values
+
+class FakeTextEmbeddingModel:
+    """Stands in for aiplatform.TextEmbeddingModel without network access.
+
+    Vectors are a signed hashing of the text's words, so they are identical across runs
+    and texts sharing words are similar. Each call sleeps call_ms plus item_ms per text.
+    """
+
+    dim = 768
+    call_ms = 0.0
+    item_ms = 0.0
+    calls = 0
+    texts = 0
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self._buckets = {}
+
+    @classmethod
+    def from_pretrained(cls, model_name):
+        return cls()
+
+    def _bucket(self, word):
+        bucket = self._buckets.get(word)
+        if bucket is None:
+            digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            bucket = self._buckets[word] = (value % self.dim, 1.0 if (value >> 32) & 1 else -1.0)
+        return bucket
+
+    def get_embeddings(self, texts):
+        with FakeTextEmbeddingModel._lock:
+            FakeTextEmbeddingModel.calls += 1
+            FakeTextEmbeddingModel.texts += len(texts)
+        delay = (self.call_ms + self.item_ms * len(texts)) / 1000.0
+        if delay > 0:
+            time.sleep(delay)
+        embeddings = []
+        for text in texts:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for word in _WORD.findall(text.lower()):
+                index, sign = self._bucket(word)
+                vector[index] += sign
+            embeddings.append(FakeEmbedding(vector.tolist()))
+        return embeddings
+
+def install_fake_vertex(dim=768, call_ms=0.0, item_ms=0.0):
+    """Makes `from google.cloud import aiplatform` resolve to the fake model (call before importing main_rag)."""
+    FakeTextEmbeddingModel.dim = dim
+    FakeTextEmbeddingModel.call_ms = call_ms
+    FakeTextEmbeddingModel.item_ms = item_ms
+    aiplatform = types.ModuleType('google.cloud.aiplatform')
+    aiplatform.TextEmbeddingModel = FakeTextEmbeddingModel
+    aiplatform.errors = types.SimpleNamespace(ApiException=type('ApiException', (Exception,), {}))
+    _ensure_namespace_packages('google', 'google.cloud')
+    sys.modules['google.cloud.aiplatform'] = aiplatform
+    sys.modules['google.cloud'].aiplatform = aiplatform
+    return FakeTextEmbeddingModel
+
+class FakePart:
+    def __init__(self, text):
+        self.text = text
+
+class FakeChunk:
+    def __init__(self, text):
+        self.parts = [FakePart(text)]
+
+# What a model asks for when one question needs several tools (FakeAgent.tool_calls)
+TOOL_CALLS = [
+    ("get_transport_disruptions_tool", {"filter": "line 1"}),
+    ("get_transport_schedule_tool", {"line_number": "1"}),
+    ("query_gent_knowledge_base_tool", {"query": "Where can I buy a De Lijn ticket?"}),
+    ("get_transport_schedule_tool", {"stop_id": "200144"}),
+]
+
+class FakeAgent:
+    """Stands in for google.adk's Agent: replies with a canned text split into chunks.
+
+    Waits first_token_ms (plus tool_ms, as if one tool call ran first) before the first
+    chunk and chunk_ms between chunks, sleeping like a blocked network call. If tool_calls
+    lists (tool name, kwargs) pairs, the model "asks" for them after first_token_ms and they
+    are dispatched like the ADK does with the function calls of one response: the tools'
+    coroutines awaited together (or one after the other with parallel_tools = False).
+    The input may be a message or a list of {"role", "parts"} contents ending in one.
+    """
+
+    first_token_ms = 300.0
+    chunk_ms = 20.0
+    tool_ms = 0.0
+    chunks = 20
+    tool_calls = ()
+    parallel_tools = True
+
+    def __init__(self, **config):
+        self.config = config
+        self.tools = config.get("tools", [])
+
+    async def _call_tools(self):
+        tools = {tool.fn.__name__: tool.fn for tool in self.tools}
+        calls = [tools[name](**kwargs) for name, kwargs in self.tool_calls]
+        if self.parallel_tools:
+            return await asyncio.gather(*calls)
+        return [await call for call in calls]
+
+    def _chunks(self, contents):
+        user_input = contents[-1]["parts"][0]["text"] if isinstance(contents, list) else contents
+        time.sleep(self.first_token_ms / 1000.0)
+        if self.tool_calls:
+            asyncio.run(self._call_tools())
+        time.sleep(self.tool_ms / 1000.0)
+        for i in range(self.chunks):
+            if i:
+                time.sleep(self.chunk_ms / 1000.0)
+            yield FakeChunk(f"[{i}] Answer about {user_input[:40]!r}. ")
+
+    def generate_content(self, contents, stream=False):
+        if stream:
+            return self._chunks(contents)
+        return types.SimpleNamespace(parts=[part for chunk in self._chunks(contents) for part in chunk.parts])
+
+class FakeFunctionTool:
+    def __init__(self, fn, description=""):
+        self.fn = fn
+        self.description = description
+
+def _ensure_namespace_packages(*names):
+    for name in names:
+        if name not in sys.modules:
+            try:
+                __import__(name)
+            except ImportError:
+                sys.modules[name] = types.ModuleType(name)
+                sys.modules[name].__path__ = []
+
+def install_fake_adk(first_token_ms=300.0, chunk_ms=20.0, chunks=20, tool_ms=0.0):
+    """Makes `google.adk.agent.Agent` and `google.adk.tools.FunctionTool` resolve to the fakes (call before importing agent)."""
+    FakeAgent.first_token_ms = first_token_ms
+    FakeAgent.chunk_ms = chunk_ms
+    FakeAgent.chunks = chunks
+    FakeAgent.tool_ms = tool_ms
+    _ensure_namespace_packages('google')
+    adk = types.ModuleType('google.adk')
+    adk.__path__ = []
+    adk.agent = types.ModuleType('google.adk.agent')
+    adk.agent.Agent = FakeAgent
+    adk.tools = types.ModuleType('google.adk.tools')
+    adk.tools.FunctionTool = FakeFunctionTool
+    sys.modules.update({'google.adk': adk, 'google.adk.agent': adk.agent, 'google.adk.tools': adk.tools})
+    sys.modules['google'].adk = adk
+    return FakeAgent
+
+# --- Synthetic knowledge base ---
+SERVICES = [
+    ("Waste Collection", "Residual waste in gray bags, paper and cardboard, PMD in blue bags and glass are collected"),
+    ("Library Opening Hours", "The library branch lends books, films and games and offers free wifi and study places"),
+    ("Recycling Park", "Bulky waste, wood, metal, electronics and garden waste can be dropped off at the recycling park"),
+    ("Parking Permits", "Residents can apply for a parking permit for their car in the paid parking zone"),
+    ("Sports Centre", "The sports centre has a swimming pool, sports halls and fitness rooms open to all residents"),
+    ("Civil Registry", "Passports, identity cards and birth certificates are issued at the service desk by appointment"),
+    ("Childcare", "Daycare places for children under three are allocated through the central registration point"),
+    ("Bicycle Parking", "Covered and guarded bicycle parkings are free for the first 24 hours"),
+    ("Community Centre", "The community centre hosts neighbourhood activities, language classes and social services"),
+    ("Street Works", "Planned road works cause detours for cars, cyclists and public transport"),
+]
+DISTRICTS = ["Binnenstad", "Gentbrugge", "Ledeberg", "Sint-Amandsberg", "Oostakker", "Wondelgem", "Mariakerke",
+             "Drongen", "Sint-Denijs-Westrem", "Zwijnaarde", "Kanaaldorpen", "Muide", "Rabot", "Brugse Poort"]
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+
+def synthetic_document(i, rng):
+    service, description = SERVICES[i % len(SERVICES)]
+    district = DISTRICTS[(i // len(SERVICES)) % len(DISTRICTS)]
+    day = DAYS[rng.randrange(len(DAYS))]
+    opens, closes = rng.randrange(7, 11), rng.randrange(16, 21)
+    content = (f"{description} in {district}. In {district} this happens on {day} from {opens}:00 to {closes}:00. "
+               f"Reference {i}: more information is available at the city contact centre on +32 9 210 10 10 "
+               f"or via stad.gent. Bring your identity card and, where required, proof of residence in Gent.")
+    return {"id": f"doc-{i}", "title": f"{service} {district} {i}", "content": content}
+
+def write_synthetic_kb(path, n_docs, seed=42):
+    """Writes n_docs synthetic city-service documents one at a time (no full list in memory),
+    as JSON Lines if path ends with .jsonl, else as a JSON list."""
+    rng = random.Random(seed)
+    jsonl = path.endswith('.jsonl')
+    with open(path, 'w', encoding='utf-8') as f:
+        if not jsonl:
+            f.write('[\n')
+        for i in range(n_docs):
+            if i and not jsonl:
+                f.write(',\n')
+            json.dump(synthetic_document(i, rng), f, ensure_ascii=False)
+            if jsonl:
+                f.write('\n')
+        if not jsonl:
+            f.write('\n]\n')
+    return path
+
+def synthetic_queries(n_queries, seed=7):
+    """Paraphrased questions about the synthetic KB; repeats are intended (they exercise the caches)."""
+    rng = random.Random(seed)
+    templates = ["when is {service} in {district}", "{service} {district} opening hours",
+                 "where can I find {service} near {district}", "how does {service} work in {district}"]
+    return [rng.choice(templates).format(service=rng.choice(SERVICES)[0].lower(), district=rng.choice(DISTRICTS))
+            for _ in range(n_queries)]
+
+# --- Mock De Lijn API ---
+class MockDeLijnServer:
+    """Local HTTP server answering /disruptions and /schedule like the De Lijn endpoints main_transport.py calls.
+
+    Every response waits latency_ms (plus up to jitter_ms), and a fraction error_rate of
+    them fails with a 503. Runs on a background thread; use as a context manager.
+    """
+
+    def __init__(self, latency_ms=50.0, jitter_ms=0.0, error_rate=0.0, seed=0, n_disruptions=40, n_departures=20):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._disruptions = json.dumps({
+            "interruptions": [{"type": "Interruption", "lines": str(line), "details": f"Line {line} does not run between Korenmarkt and Zuid"}
+                              for line in range(1, n_disruptions // 2 + 1)],
+            "detours": [{"type": "Detour", "lines": str(line), "details": f"Line {line} diverted via Sint-Pietersstation"}
+                        for line in range(1, n_disruptions - n_disruptions // 2 + 1)],
+        }).encode('utf-8')
+        self._departures = [{"line": str(1 + i % 10), "time": f"{8 + i // 6:02d}:{(i * 10) % 60:02d}", "direction": "Flanders Expo"}
+                            for i in range(n_departures)]
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _respond(self, path, params):
+        with self._lock:
+            self.requests += 1
+            delay = (self.latency_ms + self._rng.uniform(0, self.jitter_ms)) / 1000.0
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        time.sleep(delay)
+        if fail:
+            return 503, b'{"error": "Service unavailable"}'
+        if path.endswith('/disruptions'):
+            return 200, self._disruptions
+        if path.endswith('/schedule'):
+            line = params.get('lineFilter', [None])[0]
+            departures = [d for d in self._departures if line is None or d["line"] == line]
+            return 200, json.dumps({"departures": departures}).encode('utf-8')
+        return 404, b'{"error": "Not found"}'
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                status, body = mock._respond(parsed.path, parse_qs(parsed.query))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+# --- Mock tool functions ---
+class MockToolServer:
+    """Local HTTP server standing in for the three Cloud Functions the agent's tools POST to.
+
+    Every request waits latency_ms and answers {"status": "success"}. The (start, end) time
+    of each request is recorded, so callers can see whether tool calls overlapped, and so is
+    the number of TCP connections accepted, so they can see whether connections were reused.
+    """
+
+    def __init__(self, latency_ms=100.0):
+        self.latency_ms = latency_ms
+        self.intervals = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def peak_concurrency(self):
+        """Most requests in progress at the same time."""
+        events = sorted([(start, 1) for start, _ in self.intervals] + [(end, -1) for _, end in self.intervals])
+        peak = current = 0
+        for _, step in events:
+            current += step
+            peak = max(peak, current)
+        return peak
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with mock._lock:
+                    mock.connections += 1
+
+            def do_POST(self):
+                start = time.perf_counter()
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                time.sleep(mock.latency_ms / 1000.0)
+                body = b'{"status": "success"}'
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with mock._lock:
+                    mock.intervals.append((start, time.perf_counter()))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
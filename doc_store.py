@@ -0,0 +1,164 @@
+# doc_store.py (columnar storage of passage text for main_rag.py)
+import numpy as np
+
+class TextColumn:
+    """Strings stored as one UTF-8 byte buffer plus an int64 offsets array.
+
+    String i is buffer[offsets[i]:offsets[i + 1]]. Costs len(utf8) + 8 bytes per entry,
+    instead of a Python str object (~50 bytes of header, up to 4 bytes per character)
+    per entry.
+    """
+
+    def __init__(self, buffer=None, offsets=None):
+        self.buffer = buffer if buffer is not None else np.zeros(0, dtype=np.uint8)
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return bytes(self.buffer[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        return self.buffer.nbytes + self.offsets.nbytes
+
+class TextColumnBuilder:
+    """Appends strings into growing chunks; build() joins them once into a TextColumn."""
+
+    def __init__(self):
+        self._chunks = []
+        self._lengths = []
+
+    def append(self, s):
+        data = s.encode('utf-8')
+        self._chunks.append(data)
+        self._lengths.append(len(data))
+        return len(self._lengths) - 1
+
+    def build(self):
+        offsets = np.zeros(len(self._lengths) + 1, dtype=np.int64)
+        np.cumsum(self._lengths, out=offsets[1:])
+        buffer = np.frombuffer(b''.join(self._chunks), dtype=np.uint8)
+        self._chunks, self._lengths = [], []
+        return TextColumn(buffer, offsets)
+
+class DocumentTable:
+    """Per-document records kept for reload diffs: the ID (TextColumn) and a 32-byte content digest."""
+
+    def __init__(self, ids, digests):
+        self.ids = ids
+        self.digests = digests
+
+    @classmethod
+    def from_records(cls, records):
+        ids = TextColumnBuilder()
+        digests = []
+        for doc_id, digest in records:
+            ids.append(doc_id)
+            digests.append(digest)
+        return cls(ids.build(), np.frombuffer(b''.join(digests), dtype=np.uint8).reshape(len(digests), 32))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, i):
+        return {"id": self.ids[i], "hash": self.digests[i].tobytes().hex()}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        return self.ids.nbytes() + self.digests.nbytes
+
+class PassageStore:
+    """Column-oriented replacement for a list of passage dicts.
+
+    Holds doc_index and passage_index as int32 arrays, each distinct title once (titles
+    repeat for every passage of a document) and the passage texts in a TextColumn.
+    Indexing returns the same dict a passage list held, so callers keep using
+    passages[i]['title'] and passages[i]['text'].
+    """
+
+    def __init__(self, doc_index, passage_index, title_ids, titles, texts):
+        self.doc_index = doc_index
+        self.passage_index = passage_index
+        self.title_ids = title_ids
+        self.titles = titles
+        self.texts = texts
+
+    def __len__(self):
+        return self.doc_index.shape[0]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, i):
+        return {
+            "doc_index": int(self.doc_index[i]),
+            "passage_index": int(self.passage_index[i]),
+            "title": self.title(i),
+            "text": self.texts[i],
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def title(self, i):
+        return self.titles[int(self.title_ids[i])]
+
+    def passage_titles(self):
+        """Sequence view of the title of every passage (decoded on access, nothing copied)."""
+        return PassageTitles(self)
+
+    def nbytes(self):
+        """Bytes held by the store's arrays."""
+        return (self.doc_index.nbytes + self.passage_index.nbytes + self.title_ids.nbytes
+                + self.titles.nbytes() + self.texts.nbytes())
+
+class PassageTitles:
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, i):
+        return self._store.title(i)
+
+class PassageStoreBuilder:
+    """Collects passages one at a time (see ingestion.index_documents) and packs them into a PassageStore."""
+
+    def __init__(self):
+        self._doc_index = []
+        self._passage_index = []
+        self._title_ids = []
+        self._title_lookup = {}
+        self._titles = TextColumnBuilder()
+        self._texts = TextColumnBuilder()
+
+    def append(self, doc_index, passage_index, title, text):
+        title_id = self._title_lookup.get(title)
+        if title_id is None:
+            title_id = self._title_lookup[title] = self._titles.append(title)
+        self._doc_index.append(doc_index)
+        self._passage_index.append(passage_index)
+        self._title_ids.append(title_id)
+        self._texts.append(text)
+
+    def __len__(self):
+        return len(self._doc_index)
+
+    def build(self):
+        return PassageStore(np.asarray(self._doc_index, dtype=np.int32), np.asarray(self._passage_index, dtype=np.int32),
+                            np.asarray(self._title_ids, dtype=np.int32), self._titles.build(), self._texts.build())
@@ -0,0 +1,79 @@
+# embedding_batcher.py (coalesces concurrent query embeddings into one get_embeddings call)
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class EmbeddingBatcher:
+    """Gathers texts submitted from concurrent request threads and embeds them together.
+
+    A background worker takes the first pending text, then keeps collecting until
+    max_batch_size texts are queued or max_wait_ms has passed since the first one,
+    and sends the whole group in a single embed_fn(texts) call. Up to max_in_flight
+    batches are sent concurrently. Each caller blocks only on its own result.
+    """
+
+    def __init__(self, embed_fn, max_batch_size=16, max_wait_ms=5.0, max_in_flight=4):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._senders = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embedding-batch")
+        self._worker = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, text):
+        """Queues a text and returns a Future resolving to its embedding."""
+        future = Future()
+        self._queue.put((text, future))
+        self._ensure_worker()
+        return future
+
+    def embed(self, text, timeout=None):
+        """Blocking helper: the embedding of one text, computed as part of a batch."""
+        return self.submit(text).result(timeout=timeout)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._senders.submit(self._flush, batch)
+
+    def _flush(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            embeddings = self.embed_fn(texts)
+            if len(embeddings) != len(batch):
+                raise ValueError(f"Embedding model returned {len(embeddings)} vectors for {len(batch)} inputs")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+        for (_, future), embedding in zip(batch, embeddings):
+            future.set_result(embedding)
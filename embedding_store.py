@@ -0,0 +1,85 @@
+# embedding_store.py (persistent embedding cache for main_rag.py)
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# File names inside the cache directory
+VECTORS_FILE = "embeddings.npy"
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+def document_key(model_name, content):
+    """Content-addressed key for a document: sha256 of the model name and the document content."""
+    digest = hashlib.sha256()
+    digest.update(model_name.encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(content.encode('utf-8'))
+    return digest.hexdigest()
+
+def load_embedding_cache(cache_dir, model_name):
+    """Loads cached vectors as a read-only memory map.
+
+    Returns (keys, matrix) where row i of the matrix is the vector for keys[i],
+    or ([], None) when there is no usable cache for this model.
+    """
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    vectors_path = os.path.join(cache_dir, VECTORS_FILE)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != MANIFEST_VERSION or manifest.get('model') != model_name:
+            print(f"Embedding cache at {cache_dir} was built for another model or format, ignoring it.")
+            return [], None
+        matrix = np.load(vectors_path, mmap_mode='r')
+        keys = manifest.get('keys', [])
+        if matrix.ndim != 2 or matrix.shape[0] != len(keys) or matrix.dtype != np.float32:
+            print(f"Embedding cache at {cache_dir} is inconsistent with its manifest, ignoring it.")
+            return [], None
+        print(f"Loaded {len(keys)} cached embeddings from {cache_dir}")
+        return keys, matrix
+    except FileNotFoundError:
+        print(f"No embedding cache found at {cache_dir}")
+        return [], None
+    except Exception as e:
+        print(f"Error loading embedding cache from {cache_dir}: {e}")
+        return [], None
+
+def save_embedding_cache(cache_dir, model_name, keys, matrix):
+    """Writes vectors and manifest atomically (temp file + rename). Returns True on success."""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        vectors_path = os.path.join(cache_dir, VECTORS_FILE)
+        manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+        tmp_vectors = vectors_path + ".tmp"
+        tmp_manifest = manifest_path + ".tmp"
+        # np.save would append '.npy' to a path without that suffix, so write through a file object
+        with open(tmp_vectors, 'wb') as f:
+            np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "model": model_name,
+                "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+                "keys": list(keys),
+            }, f)
+        # Vectors first: a manifest is never published before the rows it describes
+        os.replace(tmp_vectors, vectors_path)
+        os.replace(tmp_manifest, manifest_path)
+        print(f"Saved {len(keys)} embeddings to cache at {cache_dir}")
+        return True
+    except Exception as e:
+        print(f"Could not write embedding cache to {cache_dir}: {e}")
+        return False
+
+def resolve_cached_rows(doc_keys, cached_keys):
+    """Maps each document key to its row in the cache.
+
+    Returns (rows, missing) where rows[i] is the cache row of document i (or -1)
+    and missing lists the document indexes that need to be embedded.
+    """
+    position = {key: row for row, key in enumerate(cached_keys)}
+    rows = [position.get(key, -1) for key in doc_keys]
+    missing = [i for i, row in enumerate(rows) if row < 0]
+    return rows, missing
@@ -0,0 +1,265 @@
+# gtfs_timetable.py (offline De Lijn timetable engine for main_transport.py)
+#
+# Build once from a GTFS static feed (zip or extracted directory):
+#   python gtfs_timetable.py build de_lijn_gtfs.zip data/gtfs_timetable
+import csv
+import datetime
+import io
+import json
+import os
+import sys
+import zipfile
+from array import array
+
+import numpy as np
+
+TIMETABLE_FORMAT_VERSION = 1
+SECONDS_PER_DAY = 24 * 3600
+
+def parse_gtfs_time(value):
+    """'HH:MM:SS' to seconds since service-day midnight (GTFS allows hours >= 24)."""
+    hours, minutes, seconds = value.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def format_time(seconds):
+    """Seconds since service-day midnight to 'HH:MM' on the wall clock."""
+    seconds %= SECONDS_PER_DAY
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}"
+
+def _open_feed_file(feed_path, name):
+    """Opens one GTFS table as a csv.DictReader from a zip file or a directory (None if absent)."""
+    if zipfile.is_zipfile(feed_path):
+        archive = zipfile.ZipFile(feed_path)
+        if name not in archive.namelist():
+            return None
+        handle = io.TextIOWrapper(archive.open(name), encoding='utf-8-sig', newline='')
+    else:
+        path = os.path.join(feed_path, name)
+        if not os.path.exists(path):
+            return None
+        handle = open(path, 'r', encoding='utf-8-sig', newline='')
+    return csv.DictReader(handle)
+
+class GTFSTimetable:
+    """Array-backed timetable: departures grouped per stop and sorted by time.
+
+    Departures of stop i live in dep_times/dep_trips[stop_offsets[i]:stop_offsets[i + 1]],
+    so "next departures after T" is one binary search plus a short forward scan that
+    skips trips whose service does not run on the requested date.
+    """
+
+    def __init__(self, stop_ids, stop_names, stop_lat, stop_lon, route_names, trip_routes, trip_services,
+                 trip_headsigns, headsigns, stop_offsets, dep_times, dep_trips, service_ids, service_weekdays,
+                 service_start, service_end, exception_services, exception_dates, exception_types):
+        self.stop_ids = list(stop_ids)
+        self.stop_names = list(stop_names)
+        self.stop_lat = stop_lat
+        self.stop_lon = stop_lon
+        self.route_names = list(route_names)
+        self.trip_routes = trip_routes
+        self.trip_services = trip_services
+        self.trip_headsigns = trip_headsigns
+        self.headsigns = list(headsigns)
+        self.stop_offsets = stop_offsets
+        self.dep_times = dep_times
+        self.dep_trips = dep_trips
+        self.service_ids = list(service_ids)
+        self.service_weekdays = service_weekdays
+        self.service_start = service_start
+        self.service_end = service_end
+        self.stop_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        # (service, yyyymmdd) -> 1 added / 2 removed, from calendar_dates.txt
+        self.exceptions = {(int(s), int(d)): int(t) for s, d, t in zip(exception_services, exception_dates, exception_types)}
+        self._active_cache = {}
+
+    # --- Building ---
+    @classmethod
+    def from_gtfs(cls, feed_path):
+        """Parses a GTFS feed into compact arrays, streaming stop_times.txt row by row."""
+        stop_ids, stop_names, stop_lat, stop_lon = [], [], array('f'), array('f')
+        for row in _open_feed_file(feed_path, 'stops.txt'):
+            stop_ids.append(row['stop_id'])
+            stop_names.append(row.get('stop_name', ''))
+            stop_lat.append(float(row.get('stop_lat') or 0))
+            stop_lon.append(float(row.get('stop_lon') or 0))
+        stop_index = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+
+        route_index, route_names = {}, []
+        for row in _open_feed_file(feed_path, 'routes.txt'):
+            route_index[row['route_id']] = len(route_names)
+            route_names.append(row.get('route_short_name') or row.get('route_long_name') or row['route_id'])
+
+        service_index, service_ids = {}, []
+        def service_id_to_index(service_id):
+            if service_id not in service_index:
+                service_index[service_id] = len(service_ids)
+                service_ids.append(service_id)
+            return service_index[service_id]
+
+        trip_index, trip_routes, trip_services, trip_headsigns = {}, array('i'), array('i'), array('i')
+        headsign_index, headsigns = {}, []
+        for row in _open_feed_file(feed_path, 'trips.txt'):
+            headsign = row.get('trip_headsign', '')
+            if headsign not in headsign_index:
+                headsign_index[headsign] = len(headsigns)
+                headsigns.append(headsign)
+            trip_index[row['trip_id']] = len(trip_routes)
+            trip_routes.append(route_index.get(row['route_id'], -1))
+            trip_services.append(service_id_to_index(row['service_id']))
+            trip_headsigns.append(headsign_index[headsign])
+
+        weekday_fields = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+        calendar = {}
+        rows = _open_feed_file(feed_path, 'calendar.txt')
+        for row in rows or []:
+            mask = sum(1 << day for day, field in enumerate(weekday_fields) if row.get(field) == '1')
+            calendar[service_id_to_index(row['service_id'])] = (mask, int(row['start_date']), int(row['end_date']))
+        exception_services, exception_dates, exception_types = array('i'), array('i'), array('b')
+        rows = _open_feed_file(feed_path, 'calendar_dates.txt')
+        for row in rows or []:
+            exception_services.append(service_id_to_index(row['service_id']))
+            exception_dates.append(int(row['date']))
+            exception_types.append(int(row['exception_type']))
+
+        n_services = len(service_ids)
+        service_weekdays = np.zeros(n_services, dtype=np.uint8)
+        service_start = np.zeros(n_services, dtype=np.int32)
+        service_end = np.zeros(n_services, dtype=np.int32)
+        for service, (mask, start, end) in calendar.items():
+            service_weekdays[service], service_start[service], service_end[service] = mask, start, end
+
+        dep_stops, dep_times, dep_trips = array('i'), array('i'), array('i')
+        for row in _open_feed_file(feed_path, 'stop_times.txt'):
+            departure = row.get('departure_time') or row.get('arrival_time')
+            stop = stop_index.get(row['stop_id'])
+            trip = trip_index.get(row['trip_id'])
+            if not departure or stop is None or trip is None:
+                continue
+            dep_stops.append(stop)
+            dep_times.append(parse_gtfs_time(departure))
+            dep_trips.append(trip)
+
+        dep_stops = np.frombuffer(dep_stops, dtype=np.int32)
+        dep_times = np.frombuffer(dep_times, dtype=np.int32)
+        dep_trips = np.frombuffer(dep_trips, dtype=np.int32)
+        order = np.lexsort((dep_times, dep_stops))
+        stop_offsets = np.zeros(len(stop_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dep_stops, minlength=len(stop_ids)), out=stop_offsets[1:])
+
+        return cls(stop_ids, stop_names, np.frombuffer(stop_lat, dtype=np.float32), np.frombuffer(stop_lon, dtype=np.float32),
+                   route_names, np.frombuffer(trip_routes, dtype=np.int32), np.frombuffer(trip_services, dtype=np.int32),
+                   np.frombuffer(trip_headsigns, dtype=np.int32), headsigns, stop_offsets, dep_times[order],
+                   dep_trips[order], service_ids, service_weekdays, service_start, service_end,
+                   np.frombuffer(exception_services, dtype=np.int32), np.frombuffer(exception_dates, dtype=np.int32),
+                   np.frombuffer(exception_types, dtype=np.int8))
+
+    # --- Persistence ---
+    _ARRAYS = ['stop_lat', 'stop_lon', 'trip_routes', 'trip_services', 'trip_headsigns', 'stop_offsets',
+               'dep_times', 'dep_trips', 'service_weekdays', 'service_start', 'service_end']
+
+    def save(self, out_dir):
+        """Writes one .npy per array (memory-mappable) plus a JSON file with the string tables."""
+        os.makedirs(out_dir, exist_ok=True)
+        for name in self._ARRAYS:
+            np.save(os.path.join(out_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        exceptions = sorted(self.exceptions.items())
+        np.save(os.path.join(out_dir, "exceptions.npy"),
+                np.asarray([(s, d, t) for (s, d), t in exceptions], dtype=np.int32).reshape(-1, 3))
+        with open(os.path.join(out_dir, "strings.json"), 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": TIMETABLE_FORMAT_VERSION,
+                "stop_ids": self.stop_ids,
+                "stop_names": self.stop_names,
+                "route_names": self.route_names,
+                "headsigns": self.headsigns,
+                "service_ids": self.service_ids,
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, timetable_dir):
+        """Loads a timetable written by save(); the large departure arrays are memory-mapped."""
+        with open(os.path.join(timetable_dir, "strings.json"), 'r', encoding='utf-8') as f:
+            strings = json.load(f)
+        if strings.get("version") != TIMETABLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported timetable format in {timetable_dir}")
+        arrays = {name: np.load(os.path.join(timetable_dir, f"{name}.npy"), mmap_mode='r') for name in cls._ARRAYS}
+        exceptions = np.load(os.path.join(timetable_dir, "exceptions.npy"))
+        return cls(strings["stop_ids"], strings["stop_names"], arrays['stop_lat'], arrays['stop_lon'],
+                   strings["route_names"], arrays['trip_routes'], arrays['trip_services'], arrays['trip_headsigns'],
+                   strings["headsigns"], arrays['stop_offsets'], arrays['dep_times'], arrays['dep_trips'],
+                   strings["service_ids"], arrays['service_weekdays'], arrays['service_start'], arrays['service_end'],
+                   exceptions[:, 0], exceptions[:, 1], exceptions[:, 2])
+
+    # --- Queries ---
+    def active_services(self, date):
+        """Boolean mask of services running on a datetime.date (calendar plus calendar_dates exceptions)."""
+        ymd = date.year * 10000 + date.month * 100 + date.day
+        mask = self._active_cache.get(ymd)
+        if mask is None:
+            weekday_bit = 1 << date.weekday()
+            mask = ((self.service_weekdays & weekday_bit) != 0) & (self.service_start <= ymd) & (self.service_end >= ymd)
+            for (service, day), exception_type in self.exceptions.items():
+                if day == ymd:
+                    mask[service] = exception_type == 1
+            if len(self._active_cache) > 8:
+                self._active_cache.clear()
+            self._active_cache[ymd] = mask
+        return mask
+
+    def runs_on(self, date):
+        """True if any service of the feed runs on the date (False e.g. once the feed has expired)."""
+        return bool(self.active_services(date).any())
+
+    def feed_range(self):
+        """(first, last) service date of the feed as YYYYMMDD ints, calendar and calendar_dates together."""
+        in_calendar = self.service_weekdays != 0
+        firsts = [day for (_, day), exception_type in self.exceptions.items() if exception_type == 1]
+        lasts = list(firsts)
+        if in_calendar.any():
+            firsts.append(int(self.service_start[in_calendar].min()))
+            lasts.append(int(self.service_end[in_calendar].max()))
+        return (min(firsts), max(lasts)) if firsts else (None, None)
+
+    def _scan(self, stop, after_seconds, active, line, limit, day_shift):
+        start, end = int(self.stop_offsets[stop]), int(self.stop_offsets[stop + 1])
+        times = self.dep_times[start:end]
+        position = start + int(np.searchsorted(times, after_seconds, side='left'))
+        found = []
+        while position < end and len(found) < limit:
+            trip = int(self.dep_trips[position])
+            if active[self.trip_services[trip]]:
+                route = int(self.trip_routes[trip])
+                route_name = self.route_names[route] if route >= 0 else '?'
+                if line is None or route_name == line:
+                    found.append((int(self.dep_times[position]) - day_shift, route_name,
+                                  self.headsigns[self.trip_headsigns[trip]]))
+            position += 1
+        return found
+
+    def next_departures(self, stop_id, when, line=None, limit=5):
+        """Next departures at a stop after a datetime, as (seconds since midnight of 'when', line, headsign)."""
+        stop = self.stop_index.get(stop_id)
+        if stop is None:
+            return []
+        line = str(line) if line is not None else None
+        after = when.hour * 3600 + when.minute * 60 + when.second
+        today = when.date()
+        departures = self._scan(stop, after, self.active_services(today), line, limit, 0)
+        # Trips of yesterday's service day that run past midnight (GTFS times >= 24:00:00)
+        yesterday = today - datetime.timedelta(days=1)
+        departures += self._scan(stop, after + SECONDS_PER_DAY, self.active_services(yesterday), line, limit, SECONDS_PER_DAY)
+        departures.sort(key=lambda d: d[0])
+        return departures[:limit]
+
+    def memory_bytes(self):
+        return sum(getattr(self, name).nbytes for name in self._ARRAYS)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        timetable = GTFSTimetable.from_gtfs(sys.argv[2])
+        timetable.save(sys.argv[3])
+        print(f"Built timetable with {len(timetable.stop_ids)} stops and {len(timetable.dep_times)} departures "
+              f"({timetable.memory_bytes() / 1e6:.1f} MB of arrays) in {sys.argv[3]}")
+        sys.exit(0)
+    print("Usage: python gtfs_timetable.py build <gtfs.zip|gtfs_dir> <output_dir>")
+    sys.exit(2)
@@ -0,0 +1,166 @@
+# ingestion.py (document loading, chunking and batched embedding for main_rag.py)
+import hashlib
+import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from doc_store import DocumentTable, PassageStoreBuilder
+
+# Defaults sized for the Vertex AI text embedding API: a few instances per request and
+# inputs well under the per-instance token limit (~4 characters per token).
+DEFAULT_PASSAGE_MAX_CHARS = 2000
+DEFAULT_PASSAGE_OVERLAP_CHARS = 200
+DEFAULT_BATCH_MAX_INSTANCES = 5
+DEFAULT_BATCH_MAX_CHARS = 15000
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE_SECONDS = 0.5
+DEFAULT_BACKOFF_MAX_SECONDS = 8.0
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+def split_into_passages(text, max_chars=DEFAULT_PASSAGE_MAX_CHARS, overlap_chars=DEFAULT_PASSAGE_OVERLAP_CHARS):
+    """Splits text into passages of at most max_chars, each starting with ~overlap_chars of the previous one.
+
+    Cuts are made at sentence boundaries where possible, then at whitespace, and only
+    as a last resort in the middle of a word. Short texts are returned unchanged.
+    """
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+    overlap_chars = min(overlap_chars, max_chars // 2)
+
+    passages = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            window = text[start:end]
+            sentence_cuts = [m.end() for m in _SENTENCE_END.finditer(window) if m.end() > overlap_chars]
+            if sentence_cuts:
+                end = start + sentence_cuts[-1]
+            else:
+                space = window.rfind(' ', overlap_chars + 1)
+                if space > 0:
+                    end = start + space
+        passages.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        # Step back by the overlap, snapping forward to a word start
+        next_start = max(end - overlap_chars, start + 1)
+        space = text.find(' ', next_start, end)
+        start = space + 1 if space >= 0 else next_start
+    return [p for p in passages if p]
+
+def iter_jsonl_documents(path):
+    """Streams documents from a JSON Lines file, one object per line; invalid lines are skipped."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_number} of {path}: invalid JSON ({e})")
+
+def content_digest(doc):
+    return hashlib.sha256(f"{doc.get('title', '')}\0{doc['content']}".encode('utf-8')).digest()
+
+def index_documents(documents, max_chars=DEFAULT_PASSAGE_MAX_CHARS, overlap_chars=DEFAULT_PASSAGE_OVERLAP_CHARS):
+    """Chunks a stream of documents into passages, one document at a time.
+
+    Returns (DocumentTable, PassageStore) from doc_store.py: per document only its ID
+    and content digest are kept, and passages are packed into columnar buffers, so
+    ingesting a large file never holds the parsed file or a dict per passage. The ID
+    is the document's 'id' field, else its title (repeats get a '#n' suffix). Entries
+    without 'title' and 'content' are skipped.
+    """
+    records, passages, seen = [], PassageStoreBuilder(), {}
+    skipped = 0
+    for doc in documents:
+        if not isinstance(doc, dict) or 'title' not in doc or 'content' not in doc:
+            skipped += 1
+            continue
+        doc_id = str(doc.get('id') or doc['title'])
+        seen[doc_id] = seen.get(doc_id, 0) + 1
+        if seen[doc_id] > 1:
+            doc_id = f"{doc_id}#{seen[doc_id]}"
+        doc_index = len(records)
+        records.append((doc_id, content_digest(doc)))
+        for passage_index, chunk in enumerate(split_into_passages(doc['content'], max_chars, overlap_chars)):
+            passages.append(doc_index, passage_index, doc['title'], chunk)
+    if skipped:
+        print(f"Skipped {skipped} entries without 'title' and 'content'")
+    return DocumentTable.from_records(records), passages.build()
+
+def diff_documents(old_records, new_records):
+    """Compares two versions of the KB by document ID and content hash.
+
+    Returns a dict with the 'added', 'changed' and 'removed' IDs and the 'unchanged' count.
+    """
+    old = {record['id']: record['hash'] for record in old_records}
+    new = {record['id']: record['hash'] for record in new_records}
+    return {
+        "added": [doc_id for doc_id in new if doc_id not in old],
+        "changed": [doc_id for doc_id, digest in new.items() if doc_id in old and old[doc_id] != digest],
+        "removed": [doc_id for doc_id in old if doc_id not in new],
+        "unchanged": sum(1 for doc_id, digest in new.items() if old.get(doc_id) == digest),
+    }
+
+def make_batches(texts, max_instances=DEFAULT_BATCH_MAX_INSTANCES, max_chars=DEFAULT_BATCH_MAX_CHARS):
+    """Groups text indexes into batches limited by instance count and total characters."""
+    batches = []
+    current, current_chars = [], 0
+    for i, text in enumerate(texts):
+        if current and (len(current) >= max_instances or current_chars + len(text) > max_chars):
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(i)
+        current_chars += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+def call_with_retry(fn, max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE_SECONDS,
+                    backoff_max=DEFAULT_BACKOFF_MAX_SECONDS, sleep=time.sleep):
+    """Calls fn(), retrying failures with exponential backoff and full jitter."""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = random.uniform(0, min(backoff_max, backoff_base * (2 ** attempt)))
+            print(f"Embedding request failed ({e}), retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries})")
+            sleep(delay)
+
+def embed_texts(model, texts, max_instances=DEFAULT_BATCH_MAX_INSTANCES, max_chars=DEFAULT_BATCH_MAX_CHARS,
+                max_workers=DEFAULT_MAX_WORKERS, max_retries=DEFAULT_MAX_RETRIES):
+    """Embeds texts with a bounded thread pool, one get_embeddings call per batch.
+
+    Works with any object exposing get_embeddings(list_of_str) returning objects with
+    a 'values' attribute (or plain sequences), so a local fake model can stand in for
+    Vertex AI. Returns an (n, dim) float32 array in input order (not normalized).
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    batches = make_batches(texts, max_instances, max_chars)
+
+    def embed_batch(batch):
+        embeddings = call_with_retry(lambda: model.get_embeddings([texts[i] for i in batch]), max_retries=max_retries)
+        if len(embeddings) != len(batch):
+            raise ValueError(f"Embedding model returned {len(embeddings)} vectors for {len(batch)} inputs")
+        return [e.values if hasattr(e, 'values') else e for e in embeddings]
+
+    vectors = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as pool:
+        for batch, batch_vectors in zip(batches, pool.map(embed_batch, batches)):
+            for i, vec in zip(batch, batch_vectors):
+                vectors[i] = vec
+    print(f"Embedded {len(texts)} texts in {len(batches)} batches")
+    return np.asarray(vectors, dtype=np.float32)
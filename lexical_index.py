@@ -0,0 +1,136 @@
+# lexical_index.py (BM25 inverted index for exact-term queries in main_rag.py)
+import math
+import re
+import unicodedata
+
+import numpy as np
+
+# Small Dutch + English stopword list: enough to keep frequent function words out of the postings
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have how i in is it its me my of on or the to was what when
+where which who why will with you your can do does there this that these those
+de het een en van in is op te dat die voor met zijn aan er niet als bij ook om maar dan of
+wat wanneer waar hoe wie welke ik je u mijn uw we wij ze zij hij naar uit over tot door nog
+kan kun kunnen moet moeten wordt worden heeft hebben was deze dit
+""".split())
+
+_TOKEN = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+
+def fold_accents(text):
+    """Lowercases and strips diacritics, so 'Sint-Pietersstation' and 'sint pieters' share tokens."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def stem(token):
+    """Very light suffix stripping that is safe for both Dutch and English plurals."""
+    if token.isdigit() or len(token) <= 4:
+        return token
+    if token.endswith('en') and len(token) > 5:
+        return token[:-2]
+    if token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    """Splits text into normalized terms. Hyphenated words also yield their parts (e.g. 'sint-pieters')."""
+    terms = []
+    for match in _TOKEN.finditer(fold_accents(text)):
+        word = match.group()
+        parts = word.split('-')
+        if len(parts) > 1:
+            terms.append(''.join(parts))
+        terms.extend(parts)
+    return [stem(t) for t in terms if t not in STOPWORDS]
+
+class BM25Index:
+    """Okapi BM25 over short documents, stored as per-term numpy posting arrays."""
+
+    def __init__(self, texts, titles=None, k1=1.2, b=0.75, title_weight=2):
+        self.k1 = k1
+        self.b = b
+        postings = {}
+        lengths = []
+        for doc_id, text in enumerate(texts):
+            terms = tokenize(text)
+            if titles is not None:
+                # Title terms count extra, they are the strongest signal for short city pages
+                terms += tokenize(titles[doc_id]) * title_weight
+            lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        self.n_docs = len(lengths)
+        self.doc_lengths = np.asarray(lengths, dtype=np.float32)
+        self.avg_length = float(self.doc_lengths.mean()) if self.n_docs else 0.0
+        self.postings = {}
+        for term, entries in postings.items():
+            ids = np.fromiter((d for d, _ in entries), dtype=np.int32, count=len(entries))
+            tfs = np.fromiter((tf for _, tf in entries), dtype=np.float32, count=len(entries))
+            idf = math.log(1 + (self.n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            self.postings[term] = (ids, tfs, idf)
+
+    def scores(self, query):
+        """Returns (BM25 scores for all documents, query terms, query terms found in the index)."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        matched = []
+        if self.n_docs == 0:
+            return scores, terms, matched
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / (self.avg_length or 1.0))
+        for term in terms:
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            ids, tfs, idf = entry
+            matched.append(term)
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norm[ids])
+        return scores, terms, matched
+
+    def search(self, query, k):
+        """Top-k (doc_id, score) pairs with a positive score, best first."""
+        scores, _, _ = self.scores(query)
+        k = min(k, self.n_docs)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < self.n_docs else np.arange(self.n_docs)
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def confident_match(self, query, min_score, min_margin):
+        """Returns the doc_id of an unambiguous lexical hit, or None.
+
+        A hit is confident when every query term is known to the index, the best document
+        contains all of them, scores at least min_score, and beats the runner-up by min_margin (ratio).
+        """
+        scores, terms, matched = self.scores(query)
+        if not terms or len(matched) != len(terms) or self.n_docs == 0:
+            return None
+        order = np.argsort(-scores)[:2]
+        best = int(order[0])
+        if scores[best] < min_score:
+            return None
+        if len(order) > 1 and scores[order[1]] > 0 and scores[best] / scores[order[1]] < min_margin:
+            return None
+        for term in terms:
+            ids = self.postings[term][0]
+            if not np.any(ids == best):
+                return None
+        return best
+
+    def rare_terms(self, query, max_doc_fraction):
+        """The query's numbers and its terms found in at most max_doc_fraction of the documents
+        (at least one), e.g. a district or line. Paraphrases of a question share these."""
+        limit = max(1, max_doc_fraction * self.n_docs)
+        return frozenset(term for term in tokenize(query)
+                         if any(c.isdigit() for c in term) or (term in self.postings and len(self.postings[term][0]) <= limit))
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses several ranked lists of doc ids into one list of (doc_id, fused_score), best first."""
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -1,22 +1,148 @@
 # main_rag.py (for Cloud Function: query_gent_services_kb)
+import time
+_IMPORT_START = time.perf_counter()
 import functions_framework
-from google.cloud import aiplatform
 import numpy as np
+import math
 import os
 import json
+import subprocess
+import sys
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from embedding_store import document_key, load_embedding_cache, save_embedding_cache, resolve_cached_rows
+from ingestion import diff_documents, embed_texts, index_documents, iter_jsonl_documents
+from retrieval_index import ExactIndex, Int8ExactIndex, IVFIndex, keys_fingerprint, normalize_vector
+from query_cache import LRUCache, normalize_query
+from semantic_cache import SemanticCache
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from embedding_batcher import EmbeddingBatcher
+from response_shaping import CHARS_PER_TOKEN, record_payload, shape_passages
+import telemetry
+
+IMPORT_MS = (time.perf_counter() - _IMPORT_START) * 1000
 
 # --- Configuration ---
-# Path to the knowledge base data file
-KB_DATA_PATH = os.path.join(os.path.dirname(__file__), 'data', 'gent_services.json')
+# Path to the knowledge base data file: a JSON list, or JSON Lines (.jsonl, streamed) for large KBs
+KB_DATA_PATH = os.environ.get("KB_DATA_PATH", os.path.join(os.path.dirname(__file__), 'data', 'gent_services.json'))
 # Model to use for embeddings
 EMBEDDING_MODEL_NAME = "textembedding-gecko@001" # Or a newer version like text-embedding-005
+# Number of documents returned per query (can be overridden per request with 'top_k')
+DEFAULT_TOP_K = int(os.environ.get("RAG_TOP_K", "3"))
+MAX_TOP_K = 20
+# Optional minimum cosine similarity for a document to count as a match (can be overridden with 'threshold')
+SIMILARITY_THRESHOLD = float(os.environ["RAG_SIMILARITY_THRESHOLD"]) if os.environ.get("RAG_SIMILARITY_THRESHOLD") else None
+# Directory holding the persistent embedding cache (embeddings.npy + manifest.json)
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", os.path.join(os.path.dirname(__file__), 'data', 'embedding_cache'))
+# Write newly computed embeddings back to the cache on startup (the deployed source dir is usually read-only)
+EMBEDDING_CACHE_WRITE = os.environ.get("EMBEDDING_CACHE_WRITE", "false").lower() in ("1", "true", "yes")
+# Vector search backend: "exact" (brute force) or "ivf" (approximate, built offline with build-index)
+RAG_INDEX_BACKEND = os.environ.get("RAG_INDEX_BACKEND", "exact").lower()
+IVF_INDEX_PATH = os.environ.get("IVF_INDEX_PATH", os.path.join(os.path.dirname(__file__), 'data', 'gent_services.ivf.npz'))
+# IVF knobs: more lists = smaller scans, more probed lists = higher recall but slower queries
+IVF_N_LISTS = int(os.environ["IVF_N_LISTS"]) if os.environ.get("IVF_N_LISTS") else None
+IVF_N_PROBE = int(os.environ.get("IVF_N_PROBE", "8"))
+# In-memory vector format of the exact backend: "float32", or "int8" (4x smaller, slightly less exact scores)
+RAG_VECTOR_DTYPE = os.environ.get("RAG_VECTOR_DTYPE", "float32").lower()
+# Hybrid retrieval: fuse BM25 and vector rankings (reciprocal rank fusion) instead of vector search alone
+RAG_HYBRID = os.environ.get("RAG_HYBRID", "true").lower() in ("1", "true", "yes")
+RRF_K = int(os.environ.get("RRF_K", "60"))
+# Candidates taken from each ranking before fusion (at least top_k)
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))
+# Lexical fast path: answer unambiguous exact-term matches without calling the embedding model
+LEXICAL_FASTPATH = os.environ.get("LEXICAL_FASTPATH", "true").lower() in ("1", "true", "yes")
+LEXICAL_FASTPATH_MIN_SCORE = float(os.environ.get("LEXICAL_FASTPATH_MIN_SCORE", "1.5"))
+LEXICAL_FASTPATH_MIN_MARGIN = float(os.environ.get("LEXICAL_FASTPATH_MIN_MARGIN", "2.0"))
+# Query caches: normalized query -> embedding, and (query, top_k, threshold, max_chars) -> response
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL_SECONDS = float(os.environ["QUERY_CACHE_TTL_SECONDS"]) if os.environ.get("QUERY_CACHE_TTL_SECONDS") else None
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get("RESULT_CACHE_TTL_SECONDS", "3600"))
+# Semantic answer cache: a query whose embedding has at least this cosine similarity to a recent
+# query's, with the same options, gets that query's answer without a retrieval pass (SEMANTIC_CACHE_SIZE=0 disables it)
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", "512"))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+# Numbers and terms in at most this fraction of the passages (district, line, service names) must
+# also be equal, so "paper collection Gentbrugge" never gets the answer for Ledeberg
+SEMANTIC_CACHE_RARE_TERM_MAX_DF = float(os.environ.get("SEMANTIC_CACHE_RARE_TERM_MAX_DF", "0.01"))
+# Micro-batching of concurrent query embeddings (useful with function concurrency > 1); 0 disables it
+QUERY_BATCH_WINDOW_MS = float(os.environ.get("QUERY_BATCH_WINDOW_MS", "0"))
+QUERY_BATCH_MAX_SIZE = int(os.environ.get("QUERY_BATCH_MAX_SIZE", "16"))
+# Response shaping: returned passages are cut down to their most query-relevant sentences, within
+# this many characters over all results (0 returns whole passages; per request: 'max_chars').
+# RAG_RESPONSE_MAX_TOKENS sets the same budget in estimated tokens instead.
+RAG_RESPONSE_MAX_CHARS = (int(os.environ["RAG_RESPONSE_MAX_TOKENS"]) * CHARS_PER_TOKEN if os.environ.get("RAG_RESPONSE_MAX_TOKENS")
+                          else int(os.environ.get("RAG_RESPONSE_MAX_CHARS", "1200")))
+# Chunking and batching limits for document ingestion (see ingestion.py)
+PASSAGE_MAX_CHARS = int(os.environ.get("PASSAGE_MAX_CHARS", "2000"))
+PASSAGE_OVERLAP_CHARS = int(os.environ.get("PASSAGE_OVERLAP_CHARS", "200"))
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "5"))
+EMBEDDING_BATCH_MAX_CHARS = int(os.environ.get("EMBEDDING_BATCH_MAX_CHARS", "15000"))
+EMBEDDING_WORKERS = int(os.environ.get("EMBEDDING_WORKERS", "4"))
+# Passages embedded per chunk during ingestion, which bounds the memory held by raw API vectors
+EMBEDDING_CHUNK_SIZE = int(os.environ.get("EMBEDDING_CHUNK_SIZE", "1024"))
+# Check the KB file for changes every N seconds and hot-reload it (0 disables the watcher)
+KB_RELOAD_INTERVAL_SECONDS = float(os.environ.get("KB_RELOAD_INTERVAL_SECONDS", "0"))
+# Cold start: build the lexical index synchronously and load vectors/connect the model on a background
+# thread, answering queries lexically until it finishes (needs CPU allocated outside requests to help)
+RAG_BACKGROUND_INIT = os.environ.get("RAG_BACKGROUND_INIT", "true").lower() in ("1", "true", "yes")
+# After a failed initialization, queries wait this long before retrying it, doubling per
+# consecutive failure up to the max (and get the stored error meanwhile)
+INIT_RETRY_BASE_SECONDS = float(os.environ.get("RAG_INIT_RETRY_BASE_SECONDS", "5"))
+INIT_RETRY_MAX_SECONDS = float(os.environ.get("RAG_INIT_RETRY_MAX_SECONDS", "300"))
+# Log import and init phase timings as one JSON line at startup (see 'python main_rag.py profile-startup')
+STARTUP_PROFILE = os.environ.get("STARTUP_PROFILE", "false").lower() in ("1", "true", "yes")
 
 # --- Globals --- 
-# Store document objects (dictionaries) and their embeddings
+# One version of the knowledge base. Queries read KB once and use that snapshot throughout, so a
+# reload that swaps in a new KnowledgeBase never mixes passages and vectors of two versions.
+# matrix and search_index are None until the vectors are loaded.
+KnowledgeBase = namedtuple('KnowledgeBase', ['version', 'documents', 'passages', 'lexical_index', 'keys', 'matrix', 'search_index'])
+KB = None
+# The globals below mirror the fields of KB for the offline build steps and diagnostics
+# DocumentTable (doc_store.py) of document IDs and content digests; their content lives in PASSAGES
 DOCUMENTS = [] 
-DOC_EMBEDDINGS = []
+# PassageStore (doc_store.py): columnar passages (chunks of document content) that are actually
+# embedded; PASSAGES[i] gives a dict with 'doc_index', 'passage_index', 'title' and 'text'
+PASSAGES = []
+# Cache keys (hash of model name + passage text) of PASSAGES, in the same order
+DOC_KEYS = []
+# Pre-normalized float32 matrix (n_passages x dim), row i is the embedding of PASSAGES[i]
+# (None when the int8 index holds the only in-memory copy)
+DOC_MATRIX = None
+# Search index over DOC_MATRIX (ExactIndex, Int8ExactIndex or IVFIndex from retrieval_index.py)
+SEARCH_INDEX = None
+# BM25 index over PASSAGES (title + text)
+LEXICAL_INDEX = None
 embedding_model = None
 model_initialized = False
+QUERY_EMBEDDING_CACHE = LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS)
+RESULT_CACHE = LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SECONDS)
+# Answers of recent queries by embedding, for paraphrases that miss RESULT_CACHE
+SEMANTIC_CACHE = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_SECONDS)
+# Shared EmbeddingBatcher for query embeddings, created when QUERY_BATCH_WINDOW_MS > 0
+QUERY_BATCHER = None
+# google.cloud.aiplatform, imported on first use because it dominates the import time
+aiplatform = None
+# Set once vectors, model and search index are ready; until then queries are answered from BM25
+VECTORS_READY = threading.Event()
+INIT_LOCK = threading.Lock()
+DOCUMENTS_LOCK = threading.Lock()
+INIT_THREAD = None
+RELOAD_THREAD = None
+# (mtime, size) of the KB file behind the published KB, compared by the reload watcher
+KB_FILE_SIGNATURE = None
+# Duration (ms) of each initialization phase, for the startup profile
+INIT_PHASES_MS = {}
+# Consecutive failed initializations, the error returned meanwhile and when (time.monotonic()) to retry
+init_failures = 0
+init_error = None
+init_retry_at = 0.0
+DOCUMENTS_UNAVAILABLE = "Knowledge base documents not available. Check function logs for errors."
+MODEL_UNAVAILABLE = "Embedding model or documents not available. Check function logs for errors."
 
 # --- Initialization Functions ---
 def load_documents_from_json(file_path):
@@ -40,115 +166,560 @@ def load_documents_from_json(file_path):
         print(f"Error loading documents: {e}")
         return []
 
-def init_model_and_embeddings():
-    """Initializes the embedding model and computes document embeddings."""
-    global embedding_model, DOC_EMBEDDINGS, DOCUMENTS, model_initialized
-    
-    if model_initialized:
+def get_aiplatform():
+    """Imports the Vertex AI SDK on first use."""
+    global aiplatform
+    if aiplatform is None:
+        from google.cloud import aiplatform as sdk
+        aiplatform = sdk
+    return aiplatform
+
+def vertex_api_errors():
+    """Vertex AI exception types to catch; empty until the SDK has been imported."""
+    return (aiplatform.errors.ApiException,) if aiplatform is not None else ()
+
+@contextmanager
+def startup_phase(name):
+    """Times one initialization phase into INIT_PHASES_MS (and the 'rag.init.<name>' stage)."""
+    start = time.perf_counter()
+    with telemetry.span(f"rag.init.{name}"):
+        yield
+    INIT_PHASES_MS[name] = round((time.perf_counter() - start) * 1000, 3)
+
+def kb_file_signature(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def load_documents(file_path):
+    """Loads the KB file into (document records, passages); .jsonl files are streamed line by line."""
+    try:
+        if file_path.endswith('.jsonl'):
+            records, passages = index_documents(iter_jsonl_documents(file_path), PASSAGE_MAX_CHARS, PASSAGE_OVERLAP_CHARS)
+            print(f"Successfully loaded {len(records)} documents from {file_path}")
+        else:
+            records, passages = index_documents(load_documents_from_json(file_path), PASSAGE_MAX_CHARS, PASSAGE_OVERLAP_CHARS)
+        return records, passages
+    except FileNotFoundError:
+        print(f"Error: Knowledge base file not found at {file_path}")
+        return [], []
+    except Exception as e:
+        print(f"Error loading documents: {e}")
+        return [], []
+
+def publish_knowledge_base(kb):
+    """Swaps in a new KB snapshot (a single assignment, so readers see either the old or the new one)."""
+    global KB, DOCUMENTS, PASSAGES, LEXICAL_INDEX, DOC_KEYS, DOC_MATRIX, SEARCH_INDEX
+    KB = kb
+    DOCUMENTS, PASSAGES, LEXICAL_INDEX = kb.documents, kb.passages, kb.lexical_index
+    DOC_KEYS, DOC_MATRIX, SEARCH_INDEX = kb.keys, kb.matrix, kb.search_index
+    # Result cache keys (and semantic cache scopes) include the KB version; dropping old entries just frees the memory sooner
+    RESULT_CACHE.clear()
+    SEMANTIC_CACHE.clear()
+
+def build_lexical_kb(version):
+    """Phase 1 builder: loads the KB file, chunks it and builds the BM25 index (no vectors).
+    Returns (KnowledgeBase, signature of the file it was loaded from), or (None, None) on failure."""
+    with startup_phase("load_documents"):
+        signature = kb_file_signature(KB_DATA_PATH)
+        documents, passages = load_documents(KB_DATA_PATH)
+        if not documents:
+            print("Initialization failed: No documents loaded.")
+            return None, None # Failed to load documents
+        if not passages:
+            print("Initialization failed: Documents loaded but no content found.")
+            return None, None
+    with startup_phase("build_lexical_index"):
+        lexical_index = BM25Index(passages.texts, titles=passages.passage_titles())
+    print(f"Built BM25 index with {len(lexical_index.postings)} terms over {len(passages)} passages.")
+    return KnowledgeBase(version, documents, passages, lexical_index, [], None, None), signature
+
+def init_documents():
+    """Phase 1: loads the KB, splits it into passages and builds the BM25 index.
+
+    This is all lexical retrieval needs, so queries can be served once it returns.
+    """
+    global KB_FILE_SIGNATURE
+    with DOCUMENTS_LOCK:
+        if KB is not None:
+            return True
+        kb, signature = build_lexical_kb(version=1)
+        if kb is None:
+            return False
+        publish_knowledge_base(kb)
+        KB_FILE_SIGNATURE = signature
         return True
 
-    print("Initializing RAG model and embeddings...")
-    DOCUMENTS = load_documents_from_json(KB_DATA_PATH)
-    if not DOCUMENTS:
-        print("Initialization failed: No documents loaded.")
-        return False # Failed to load documents
+def build_vector_kb(kb, previous=None, save_cache=EMBEDDING_CACHE_WRITE):
+    """Phases 2 and 3: returns kb with vectors and a search index added.
+
+    Vectors are reused from the previous KB version in memory, then from the on-disk
+    cache; only the remaining passages are embedded, in chunks of EMBEDDING_CHUNK_SIZE.
+    """
+    global embedding_model, QUERY_BATCHER
+    passage_texts = kb.passages.texts
+
+    with startup_phase("load_cached_vectors"):
+        keys = [document_key(EMBEDDING_MODEL_NAME, text) for text in passage_texts]
+        cached_keys, cached_matrix = load_embedding_cache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_NAME)
+        # Previous vectors: its float matrix, or the int8 index when that is the only copy
+        previous_vectors = None
+        if previous is not None:
+            previous_vectors = previous.matrix if previous.matrix is not None else previous.search_index
+        if previous_vectors is not None:
+            previous_rows, _ = resolve_cached_rows(keys, previous.keys)
+        else:
+            previous_rows = [-1] * len(keys)
+        cache_rows, _ = resolve_cached_rows(keys, cached_keys)
+        missing = [i for i in range(len(keys)) if previous_rows[i] < 0 and cache_rows[i] < 0]
+
+    with startup_phase("connect_model"):
+        if embedding_model is None:
+            # Ensure Vertex AI client is initialized (uses ADC or GOOGLE_APPLICATION_CREDENTIALS)
+            # Project/Location might be implicitly picked up, but explicit is safer if needed.
+            # aiplatform.init(project=os.getenv('GOOGLE_CLOUD_PROJECT'), location=os.getenv('GOOGLE_CLOUD_LOCATION'))
+            embedding_model = get_aiplatform().TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
+        if QUERY_BATCH_WINDOW_MS > 0 and QUERY_BATCHER is None:
+            QUERY_BATCHER = EmbeddingBatcher(lambda texts: embedding_model.get_embeddings(texts),
+                                             max_batch_size=QUERY_BATCH_MAX_SIZE, max_wait_ms=QUERY_BATCH_WINDOW_MS,
+                                             max_in_flight=EMBEDDING_WORKERS)
+
+    with startup_phase("embed_missing"):
+        if not missing and cached_keys == keys:
+            # Cache matches the KB exactly: serve straight from the memory map (zero-copy)
+            matrix = cached_matrix
+        else:
+            matrix = None
+            for start in range(0, len(missing), EMBEDDING_CHUNK_SIZE):
+                # Size-limited batches, sent concurrently with retry and backoff
+                chunk = missing[start:start + EMBEDDING_CHUNK_SIZE]
+                vectors = build_embedding_matrix(embed_texts(
+                    embedding_model, [passage_texts[i] for i in chunk],
+                    max_instances=EMBEDDING_BATCH_SIZE, max_chars=EMBEDDING_BATCH_MAX_CHARS, max_workers=EMBEDDING_WORKERS))
+                if matrix is None:
+                    matrix = np.empty((len(keys), vectors.shape[1]), dtype=np.float32)
+                matrix[chunk] = vectors
+            for source, rows in ((previous_vectors, previous_rows), (cached_matrix, cache_rows)):
+                if source is None:
+                    continue
+                if matrix is None:
+                    matrix = np.empty((len(keys), source.shape[1]), dtype=np.float32)
+                rows = np.asarray(rows)
+                reuse = np.nonzero(rows >= 0)[0]
+                if reuse.size:
+                    matrix[reuse] = source.dequantize(rows[reuse]) if isinstance(source, Int8ExactIndex) else source[rows[reuse]]
+            if save_cache:
+                save_embedding_cache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_NAME, keys, matrix)
+
+    with startup_phase("build_search_index"):
+        if previous is not None and isinstance(previous.search_index, IVFIndex):
+            # The saved index no longer matches the keys: carry the live one over instead of
+            # falling back to exact search (build-index retrains it)
+            search_index = previous.search_index.update(matrix, previous_rows)
+            print(f"Updated IVF index: {len(missing)} passages assigned to the nearest of {search_index.centroids.shape[0]} lists")
+            if save_cache:
+                try:
+                    search_index.save(IVF_INDEX_PATH, keys_fingerprint(keys))
+                except OSError as e:
+                    print(f"Could not save the updated IVF index to {IVF_INDEX_PATH}: {e}")
+        else:
+            search_index = load_search_index(matrix, keys)
+    if isinstance(search_index, Int8ExactIndex) and not isinstance(matrix, np.memmap):
+        # The int8 codes replace the float32 rows in memory (a memory-mapped cache costs no heap)
+        matrix = None
+    reused = len(keys) - len(missing)
+    print(f"Computed {len(missing)} embeddings, reused {reused} cached for {len(keys)} passages from {len(kb.documents)} documents.")
+    return kb._replace(keys=keys, matrix=matrix, search_index=search_index)
+
+def init_vectors(save_cache=EMBEDDING_CACHE_WRITE):
+    """Phases 2 and 3 for the current KB: loads cached vectors, connects the embedding
+    model, embeds the passages missing from the cache and builds the search index."""
+    global model_initialized
+    publish_knowledge_base(build_vector_kb(KB, save_cache=save_cache))
+    model_initialized = True
+    VECTORS_READY.set()
+    return True
+
+def record_init_result(error=None):
+    """Clears the retry backoff after a successful init, or extends it after a failed one."""
+    global init_failures, init_error, init_retry_at
+    if error is None:
+        init_failures, init_error, init_retry_at = 0, None, 0.0
+        return
+    init_failures += 1
+    init_error = error
+    delay = min(INIT_RETRY_MAX_SECONDS, INIT_RETRY_BASE_SECONDS * 2 ** (init_failures - 1))
+    init_retry_at = time.monotonic() + delay
+    telemetry.count("rag.init_failure")
+    print(f"Initialization failed ({init_failures} in a row), next attempt in {delay:.0f}s at the earliest.")
+
+def init_retry_wait():
+    """Seconds until a failed initialization may be retried (0 if it may run now)."""
+    return max(0.0, init_retry_at - time.monotonic())
+
+def init_model_and_embeddings(save_cache=EMBEDDING_CACHE_WRITE):
+    """Initializes the embedding model and loads or computes document embeddings.
+
+    Embeddings are taken from the on-disk cache when available; only documents
+    that are new or changed since the cache was built are sent to the model.
+    """
+    global embedding_model, model_initialized
+
+    with INIT_LOCK:
+        if model_initialized:
+            return True
+
+        print("Initializing RAG model and embeddings...")
+        if not init_documents():
+            record_init_result(DOCUMENTS_UNAVAILABLE)
+            return False
+        try:
+            init_vectors(save_cache)
+            record_init_result()
+            return True
+        except Exception as e:
+            print(f"Error initializing Vertex AI model or getting embeddings: {e}")
+            # Nothing was published, so the lexical-only KB keeps serving
+            embedding_model = None
+            model_initialized = False
+            record_init_result(MODEL_UNAVAILABLE)
+            return False
+        finally:
+            if STARTUP_PROFILE:
+                telemetry.log_json(message="RAG startup profile", event="startup_profile", import_ms=round(IMPORT_MS, 3),
+                                   phases_ms=dict(INIT_PHASES_MS), vectors_ready=model_initialized)
+
+def start_background_init():
+    """Builds the lexical index now and runs the vector phases on a daemon thread.
 
-    document_contents = [doc['content'] for doc in DOCUMENTS]
-    if not document_contents:
-        print("Initialization failed: Documents loaded but no content found.")
+    Returns False only if no documents could be loaded (nothing can be served).
+    """
+    global INIT_THREAD
+    if model_initialized:
+        return True
+    if not init_documents():
+        record_init_result(DOCUMENTS_UNAVAILABLE)
         return False
+    if INIT_THREAD is None or not INIT_THREAD.is_alive():
+        INIT_THREAD = threading.Thread(target=init_model_and_embeddings, name="rag-vector-init", daemon=True)
+        INIT_THREAD.start()
+    return True
+
+def reload_knowledge_base():
+    """Rebuilds the KB from KB_DATA_PATH and swaps it in without blocking queries.
+
+    Documents are compared by ID with the live version; vectors of unchanged passages
+    are reused, so only added or changed documents are embedded. In-flight queries
+    finish on the snapshot they started with. Returns the diff, or None on failure.
+    """
+    global KB_FILE_SIGNATURE
+    with INIT_LOCK:
+        current = KB
+        if current is None or not model_initialized:
+            print("Reload skipped: the knowledge base is not initialized yet.")
+            return None
+        try:
+            kb, signature = build_lexical_kb(version=current.version + 1)
+            if kb is None:
+                print("Reload failed, keeping the current knowledge base.")
+                return None
+            diff = diff_documents(current.documents, kb.documents)
+            print(f"KB diff: {len(diff['added'])} added, {len(diff['changed'])} changed, {len(diff['removed'])} removed, {diff['unchanged']} unchanged")
+            if not (diff['added'] or diff['changed'] or diff['removed']):
+                KB_FILE_SIGNATURE = signature
+                return diff
+            publish_knowledge_base(build_vector_kb(kb, previous=current))
+            # Only now: a reload that fails (e.g. embedding errors) is retried on the watcher's next poll
+            KB_FILE_SIGNATURE = signature
+            telemetry.count("rag.kb_reload")
+            return diff
+        except Exception as e:
+            print(f"Error reloading the knowledge base, keeping the current version: {e}")
+            return None
 
+def watch_knowledge_base(interval_seconds):
+    """Polls the KB file's modification time and size, reloading when they change."""
+    while True:
+        time.sleep(interval_seconds)
+        signature = kb_file_signature(KB_DATA_PATH)
+        if signature is not None and signature != KB_FILE_SIGNATURE and model_initialized:
+            print(f"Knowledge base file {KB_DATA_PATH} changed, reloading...")
+            reload_knowledge_base()
+
+def start_kb_watcher():
+    global RELOAD_THREAD
+    if KB_RELOAD_INTERVAL_SECONDS > 0 and RELOAD_THREAD is None:
+        RELOAD_THREAD = threading.Thread(target=watch_knowledge_base, args=(KB_RELOAD_INTERVAL_SECONDS,),
+                                         name="rag-kb-watcher", daemon=True)
+        RELOAD_THREAD.start()
+
+def load_search_index(matrix, keys):
+    """Returns the configured search backend, falling back to exact search if no valid IVF index exists."""
+    if RAG_INDEX_BACKEND == "ivf":
+        index = IVFIndex.load(IVF_INDEX_PATH, matrix, keys_fingerprint(keys), n_probe=IVF_N_PROBE)
+        if index is not None:
+            print(f"Using IVF index with {index.centroids.shape[0]} lists (n_probe={index.n_probe})")
+            return index
+        print("Falling back to exact search. Run 'python main_rag.py build-index' to build the IVF index.")
+        telemetry.count("rag.ivf_fallback")
+    if RAG_VECTOR_DTYPE == "int8":
+        index = Int8ExactIndex.from_matrix(matrix)
+        print(f"Using int8 exact index ({index.nbytes() / 2**20:.1f} MiB for {matrix.shape[0]} passages)")
+        return index
+    return ExactIndex(matrix)
+
+def build_ivf_index():
+    """Offline build step: trains the IVF index over the current embeddings and writes it to IVF_INDEX_PATH."""
+    if not init_model_and_embeddings():
+        return False
     try:
-        # Ensure Vertex AI client is initialized (uses ADC or GOOGLE_APPLICATION_CREDENTIALS)
-        # Project/Location might be implicitly picked up, but explicit is safer if needed.
-        # aiplatform.init(project=os.getenv('GOOGLE_CLOUD_PROJECT'), location=os.getenv('GOOGLE_CLOUD_LOCATION'))
-        embedding_model = aiplatform.TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
-        # Get embeddings in batches if necessary (though Vertex AI handles it well)
-        DOC_EMBEDDINGS = embedding_model.get_embeddings(document_contents)
-        print(f"Computed {len(DOC_EMBEDDINGS)} embeddings for {len(DOCUMENTS)} documents.")
-        model_initialized = True
+        index = IVFIndex.build(DOC_MATRIX, n_lists=IVF_N_LISTS, n_probe=IVF_N_PROBE)
+        index.save(IVF_INDEX_PATH, keys_fingerprint(DOC_KEYS))
+        print(f"Saved IVF index with {index.centroids.shape[0]} lists over {DOC_MATRIX.shape[0]} passages to {IVF_INDEX_PATH}")
         return True
     except Exception as e:
-        print(f"Error initializing Vertex AI model or getting embeddings: {e}")
-        # Reset globals if initialization fails partially
-        DOCUMENTS = []
-        DOC_EMBEDDINGS = []
-        embedding_model = None
-        model_initialized = False
+        print(f"Error building IVF index: {e}")
         return False
 
+def build_embedding_cache():
+    """Offline build step: embeds the whole KB and writes the cache for deployment."""
+    global model_initialized
+    model_initialized = False
+    if not init_model_and_embeddings(save_cache=False):
+        return False
+    return save_embedding_cache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_NAME, DOC_KEYS, DOC_MATRIX)
+
 # --- Helper Functions ---
-def cosine_similarity(a, b):
-    """Calculates cosine similarity between two embedding vectors."""
-    try:
-        # Convert embedding objects to numpy arrays if they aren't already
-        vec_a = np.array(a.values) if hasattr(a, 'values') else np.array(a)
-        vec_b = np.array(b.values) if hasattr(b, 'values') else np.array(b)
-        norm_a = np.linalg.norm(vec_a)
-        norm_b = np.linalg.norm(vec_b)
-        if norm_a == 0 or norm_b == 0:
-            return 0.0
-        return float(np.dot(vec_a, vec_b) / (norm_a * norm_b))
-    except Exception as e:
-        print(f"Error calculating cosine similarity: {e}")
-        return 0.0
+def build_embedding_matrix(embeddings):
+    """Stacks embeddings into a contiguous float32 matrix with L2-normalized rows."""
+    matrix = np.asarray([e.values if hasattr(e, 'values') else e for e in embeddings], dtype=np.float32)
+    if matrix.ndim != 2:
+        return np.zeros((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0 # Zero vectors stay zero and score 0.0 against any query
+    return np.ascontiguousarray(matrix / norms)
+
+def embed_query(query):
+    """Returns the normalized query embedding, served from the LRU cache when possible."""
+    key = normalize_query(query)
+    query_vec = QUERY_EMBEDDING_CACHE.get(key)
+    if query_vec is None:
+        telemetry.count("rag.query_embedding_cache.miss")
+        with telemetry.span("rag.embedding"):
+            if QUERY_BATCHER is not None:
+                # Coalesced with other in-flight queries into one get_embeddings call
+                query_vec = normalize_vector(QUERY_BATCHER.embed(query, timeout=30))
+            else:
+                query_vec = normalize_vector(embedding_model.get_embeddings([query])[0])
+        QUERY_EMBEDDING_CACHE.put(key, query_vec)
+    else:
+        telemetry.count("rag.query_embedding_cache.hit")
+    return query_vec
+
+def lexical_fastpath_match(query, kb):
+    """True when the lexical fast path answers the query (no embedding needed)."""
+    if not LEXICAL_FASTPATH:
+        return False
+    with telemetry.span("rag.lexical"):
+        return kb.lexical_index.confident_match(query, LEXICAL_FASTPATH_MIN_SCORE, LEXICAL_FASTPATH_MIN_MARGIN) is not None
+
+def retrieve(query, top_k, threshold=None, kb=None, query_vec=None, fastpath=None):
+    """Ranks passages of a KB snapshot (default: the current one) for a query.
+    Returns (list of (passage index, score), retrieval mode). Callers that already embedded
+    the query or checked lexical_fastpath_match pass query_vec and fastpath.
+
+    Modes: "lexical" (confident BM25 hit, no embedding call, or BM25 alone while the vectors
+    are still loading; score is the BM25 score), "vector" (cosine similarity) or "hybrid"
+    (BM25 and vector rankings fused with RRF; score is the cosine similarity, and matches are
+    (passage index, score, fused score) in fused order). threshold applies to the cosine
+    similarity in both vector modes.
+    """
+    kb = kb or KB
+    if fastpath is None:
+        fastpath = lexical_fastpath_match(query, kb)
+    if fastpath:
+        telemetry.count("rag.lexical_fastpath")
+        with telemetry.span("rag.lexical"):
+            return kb.lexical_index.search(query, top_k), "lexical"
+
+    if kb.search_index is None:
+        with telemetry.span("rag.lexical"):
+            return kb.lexical_index.search(query, top_k), "lexical"
+
+    candidates = max(top_k, HYBRID_CANDIDATES) if RAG_HYBRID else top_k
+    if query_vec is None:
+        query_vec = embed_query(query)
+    if not RAG_HYBRID:
+        with telemetry.span("rag.scoring"):
+            return kb.search_index.search(query_vec, candidates, threshold)[:top_k], "vector"
+
+    with telemetry.span("rag.scoring"):
+        vector_matches = kb.search_index.search(query_vec, candidates)
+    with telemetry.span("rag.lexical"):
+        lexical_matches = kb.lexical_index.search(query, candidates)
+    fused = reciprocal_rank_fusion([[i for i, _ in vector_matches], [i for i, _ in lexical_matches]], k=RRF_K)
+    # BM25-only candidates have no cosine score yet; the threshold and the returned score use it
+    cosine = dict(vector_matches)
+    missing = [i for i, _ in fused if i not in cosine]
+    if missing:
+        with telemetry.span("rag.scoring"):
+            cosine.update(zip(missing, (float(score) for score in kb.search_index.scores(query_vec, missing))))
+    matches = [(i, cosine[i], fused_score) for i, fused_score in fused if threshold is None or cosine[i] >= threshold]
+    return matches[:top_k], "hybrid"
+
+def cache_stats():
+    """Hit/miss counters of the query caches (and batcher sizes), for sizing them, plus stage latencies."""
+    stats = { "query_embedding_cache": QUERY_EMBEDDING_CACHE.stats(), "result_cache": RESULT_CACHE.stats(),
+              "semantic_cache": SEMANTIC_CACHE.stats(), "telemetry": telemetry.snapshot() }
+    if QUERY_BATCHER is not None:
+        stats["query_batcher"] = QUERY_BATCHER.stats()
+    kb = KB
+    if kb is not None and kb.search_index is not None:
+        # kind differs from the configured backend when IVF fell back to exact search
+        stats["search_index"] = {"kind": kb.search_index.kind, "configured": RAG_INDEX_BACKEND}
+    return stats
+
+def get_request_param(request, request_json, name):
+    """Reads a parameter from the query string first, then from the JSON body."""
+    if request.args and name in request.args:
+        return request.args.get(name)
+    if request_json and name in request_json:
+        return request_json[name]
+    return None
 
 # --- Cloud Function Entry Point ---
 
-# Attempt initialization on cold start
-init_model_and_embeddings()
+# Attempt initialization on cold start (skipped when run as the offline cache builder)
+if __name__ != "__main__":
+    with telemetry.span("rag.init"):
+        if RAG_BACKGROUND_INIT:
+            start_background_init()
+        else:
+            init_model_and_embeddings()
+    start_kb_watcher()
 
 @functions_framework.http
 def query_gent_services_kb(request):
     """HTTP Cloud Function to query the Gent services knowledge base using RAG."""
-    global model_initialized
+    telemetry.start_trace(request.headers)
+    start = time.perf_counter()
+    response = _query_gent_services_kb(request)
+    status = response[1] if isinstance(response, tuple) else 200
+    telemetry.record("rag.total", (time.perf_counter() - start) * 1000)
+    payload = response[0] if isinstance(response, tuple) else response
+    telemetry.finish_trace("query_gent_services_kb", status=status, **record_payload("rag", payload))
+    return response
+
+def _query_gent_services_kb(request):
     # Ensure model is ready, attempt re-init if failed on cold start
     if not model_initialized:
-        print("Model not ready, attempting initialization...")
-        if not init_model_and_embeddings():
-            return ("Embedding model or documents not available. Check function logs for errors.", 503) # Service Unavailable
+        wait = init_retry_wait()
+        if wait > 0:
+            # A recent attempt failed: no re-init per query, serve lexically if possible, else its error
+            if KB is None or not RAG_BACKGROUND_INIT:
+                return (init_error, 503, {"Retry-After": str(max(1, math.ceil(wait)))})
+        elif RAG_BACKGROUND_INIT:
+            # Serve lexically while the vector phases (re)run in the background
+            if not start_background_init():
+                return (init_error, 503)
+        else:
+            print("Model not ready, attempting initialization...")
+            if not init_model_and_embeddings():
+                return (init_error, 503) # Service Unavailable
 
-    # Extract query from request
+    # Extract query and retrieval options from request
     request_json = request.get_json(silent=True)
-    query = None
-    if request.args and 'query' in request.args:
-        query = request.args.get('query')
-    elif request_json and 'query' in request_json:
-        query = request_json['query']
+    if get_request_param(request, request_json, 'warmup'):
+        # Warm-up / health probe: answers without touching the model
+        return { "status": "success", "ready": { "lexical": KB is not None, "vector": VECTORS_READY.is_set() },
+                 "kb_version": KB.version if KB is not None else None, "init_phases_ms": dict(INIT_PHASES_MS) }
+    if get_request_param(request, request_json, 'cache_stats'):
+        return { "status": "success", "cache_stats": cache_stats() }
+    query = get_request_param(request, request_json, 'query')
 
     if not query:
         return ("Missing 'query' parameter in request body or query string", 400)
 
-    print(f"Received query: {query}")
-
     try:
-        # Get embedding for the user query
-        query_embedding = embedding_model.get_embeddings([query])[0]
+        top_k = get_request_param(request, request_json, 'top_k')
+        top_k = min(max(int(top_k), 1), MAX_TOP_K) if top_k is not None else DEFAULT_TOP_K
+        threshold = get_request_param(request, request_json, 'threshold')
+        threshold = float(threshold) if threshold is not None else SIMILARITY_THRESHOLD
+        max_chars = get_request_param(request, request_json, 'max_chars')
+        max_chars = max(int(max_chars), 0) if max_chars is not None else RAG_RESPONSE_MAX_CHARS
+    except (TypeError, ValueError):
+        return ("Parameters 'top_k', 'threshold' and 'max_chars' must be numeric", 400)
 
-        # Calculate similarities between query and document embeddings
-        scores = [cosine_similarity(query_embedding, doc_vec) for doc_vec in DOC_EMBEDDINGS]
+    print(f"Received query: {query} (top_k={top_k}, threshold={threshold}, max_chars={max_chars})")
 
-        if not scores:
-             return { "status": "success", "answer": "I couldn't find any relevant information in the knowledge base." }
+    # One snapshot per request: a concurrent reload does not change the KB under this query
+    kb = KB
+    result_key = (kb.version, normalize_query(query), top_k, threshold, max_chars)
+    cached_response = RESULT_CACHE.get(result_key)
+    if cached_response is not None:
+        telemetry.count("rag.result_cache.hit")
+        print(f"Result cache hit for query: {query}")
+        return cached_response
+    telemetry.count("rag.result_cache.miss")
+
+    try:
+        # Lexical fast path, or BM25 fused with vector search over the passage matrix
+        # (answers given while the vectors are still loading are not cached)
+        cacheable = kb.search_index is not None
+        fastpath = lexical_fastpath_match(query, kb)
+        query_vec = semantic_scope = None
+        if cacheable and SEMANTIC_CACHE.max_size > 0 and not fastpath:
+            # A paraphrase of a recent query: its answer, for the cost of the query embedding
+            query_vec = embed_query(query)
+            semantic_scope = (kb.version, top_k, threshold, max_chars,
+                              kb.lexical_index.rare_terms(query, SEMANTIC_CACHE_RARE_TERM_MAX_DF))
+            cached_response = SEMANTIC_CACHE.get(query_vec, semantic_scope)
+            if cached_response is not None:
+                telemetry.count("rag.semantic_cache.hit")
+                print(f"Semantic cache hit for query: {query}")
+                RESULT_CACHE.put(result_key, cached_response)
+                return cached_response
+            telemetry.count("rag.semantic_cache.miss")
+        matches, mode = retrieve(query, top_k, threshold, kb, query_vec, fastpath)
 
-        # Find the best matching document
-        best_index = int(np.argmax(scores))
-        best_score = scores[best_index]
-        best_doc = DOCUMENTS[best_index]
-        best_answer = best_doc['content'] # Return the content of the best matching document
-        best_title = best_doc.get('title', 'Unknown Title') # Get title for logging
+        if not matches:
+            if threshold is not None and kb.search_index is not None and len(kb.passages) > 0:
+                print(f"No document scored above threshold {threshold}")
+                response = { "status": "success", "results": [], "answer": "I found some related information, but I'm not sure if it directly answers your question. Could you please rephrase?" }
+            else:
+                response = { "status": "success", "results": [], "answer": "I couldn't find any relevant information in the knowledge base." }
+            response["retrieval"] = mode
+            if cacheable:
+                RESULT_CACHE.put(result_key, response)
+                if query_vec is not None:
+                    SEMANTIC_CACHE.put(query_vec, semantic_scope, response)
+            return response
 
-        print(f"Best match: '{best_title}' (Index: {best_index}, Score: {best_score:.4f})")
+        with telemetry.span("rag.format"):
+            passages = [kb.passages[match[0]] for match in matches]
+            # Only the query-relevant sentences of each passage go back into the model's context
+            contents = shape_passages([passage['text'] for passage in passages], query, max_chars)
+            results = []
+            for passage, content, match in zip(passages, contents, matches):
+                result = { "title": passage['title'], "content": content, "score": round(match[1], 4) }
+                if len(match) > 2:
+                    result["fused_score"] = round(match[2], 4)
+                results.append(result)
 
-        # Optional: Add a similarity threshold
-        # SIMILARITY_THRESHOLD = 0.7 
-        # if best_score < SIMILARITY_THRESHOLD:
-        #     print(f"Score {best_score:.4f} below threshold {SIMILARITY_THRESHOLD}")
-        #     return { "status": "success", "answer": "I found some related information, but I'm not sure if it directly answers your question. Could you please rephrase?" }
+        best_index, best_score = matches[0][:2]
+        print(f"Best match: '{results[0]['title']}' (Index: {best_index}, Score: {best_score:.4f}, {mode}), {len(results)} results returned")
 
-        return { "status": "success", "answer": best_answer }
+        # 'answer' keeps the (shaped) text of the best matching passage for existing callers
+        response = { "status": "success", "answer": results[0]['content'], "results": results, "retrieval": mode }
+        if cacheable:
+            RESULT_CACHE.put(result_key, response)
+            if query_vec is not None:
+                SEMANTIC_CACHE.put(query_vec, semantic_scope, response)
+        return response
 
-    except aiplatform.errors.ApiException as e:
+    except vertex_api_errors() as e:
          print(f"Vertex AI API Error during query embedding: {e}")
          return ("Error communicating with Vertex AI to process the query.", 500)
     except Exception as e:
@@ -156,3 +727,47 @@ def query_gent_services_kb(request):
         import traceback
         traceback.print_exc() # Print stack trace to logs
         return ("An internal error occurred while processing the query.", 500)
+
+def profile_startup():
+    """Cold-starts the module in a fresh interpreter and prints where the time goes:
+    the slowest top-level imports (python -X importtime) and each init phase."""
+    env = dict(os.environ, STARTUP_PROFILE="true", RAG_BACKGROUND_INIT="false")
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main_rag"],
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True)
+    imports = []
+    for line in completed.stderr.splitlines():
+        parts = line.split('|')
+        # Nesting is shown by indentation: keep top-level imports and the direct imports of main_rag
+        if len(parts) == 3 and parts[0].startswith("import time:") and parts[1].strip().isdigit():
+            name = parts[2][1:]
+            if len(name) - len(name.lstrip()) <= 2:
+                imports.append((int(parts[1]) / 1000, name.strip()))
+    print("Slowest imports (cumulative ms):")
+    for ms, name in sorted(imports, reverse=True)[:15]:
+        print(f"  {ms:>10.1f}  {name}")
+    profiles = [json.loads(line) for line in completed.stdout.splitlines() if '"startup_profile"' in line]
+    if not profiles:
+        print("No startup profile was logged; output of the cold start:")
+        print(completed.stdout[-2000:], completed.stderr[-2000:])
+        return False
+    profile = profiles[-1]
+    print(f"main_rag module imports: {profile['import_ms']:.1f} ms")
+    print("Init phases (ms):")
+    for name, ms in profile['phases_ms'].items():
+        print(f"  {ms:>10.1f}  {name}")
+    print(f"Vectors ready: {profile['vectors_ready']}")
+    return True
+
+if __name__ == "__main__":
+    # Offline build steps, run before deployment: python main_rag.py build-cache | build-index
+    # They write the float32 matrix, so it must stay in memory
+    RAG_VECTOR_DTYPE = "float32"
+    if len(sys.argv) > 1 and sys.argv[1] == "build-cache":
+        sys.exit(0 if build_embedding_cache() else 1)
+    if len(sys.argv) > 1 and sys.argv[1] == "build-index":
+        sys.exit(0 if build_ivf_index() else 1)
+    # Diagnostics: python main_rag.py profile-startup
+    if len(sys.argv) > 1 and sys.argv[1] == "profile-startup":
+        sys.exit(0 if profile_startup() else 1)
+    print("Usage: python main_rag.py build-cache | build-index | profile-startup")
+    sys.exit(2)
@@ -1,16 +1,173 @@
 # main_transport.py (contains De Lijn API functions)
 import functions_framework
+import datetime
 import os
+import re
+import threading
+import time
 import requests
 
+import telemetry
+from response_shaping import compact_disruptions, rank_departures, record_payload
+
 # Load API Key from environment variable set during deployment
 DE_LIJN_API_KEY = os.environ.get("DE_LIJN_API_KEY")
 # Base URL - Verify this in the official De Lijn documentation
 DE_LIJN_API_BASE_URL = os.environ.get("DE_LIJN_API_BASE_URL", "https://api.delijn.be/v1")
+# Disruption list cache: served fresh for the TTL, then served stale (while one background
+# refresh runs) for up to the stale window before a request has to wait for De Lijn again
+DISRUPTIONS_CACHE_TTL_SECONDS = float(os.environ.get("DISRUPTIONS_CACHE_TTL_SECONDS", "120"))
+DISRUPTIONS_CACHE_STALE_SECONDS = float(os.environ.get("DISRUPTIONS_CACHE_STALE_SECONDS", "600"))
+# Disruptions returned per request, after merging those of the same line into one entry (0 = all)
+DISRUPTIONS_MAX_RESULTS = int(os.environ.get("DISRUPTIONS_MAX_RESULTS", "10"))
+
+# Offline timetable built with 'python gtfs_timetable.py build'; used for static schedule questions
+GTFS_TIMETABLE_DIR = os.environ.get("GTFS_TIMETABLE_DIR", os.path.join(os.path.dirname(__file__), 'data', 'gtfs_timetable'))
+SCHEDULE_TIMEZONE = os.environ.get("SCHEDULE_TIMEZONE", "Europe/Brussels")
+# Departures returned per request, soonest first (timetable and live API alike)
+SCHEDULE_MAX_DEPARTURES = int(os.environ.get("SCHEDULE_MAX_DEPARTURES", "5"))
+# GTFS stops.txt used for stop name resolution when no timetable has been built
+GTFS_STOPS_PATH = os.environ.get("GTFS_STOPS_PATH", os.path.join(os.path.dirname(__file__), 'data', 'stops.txt'))
+
+class RevalidatingCache:
+    """Single-value cache with stale-while-revalidate and request coalescing.
+
+    Concurrent callers that miss share one fetch; callers that find stale data get
+    it immediately while a single background refresh runs. If a background refresh
+    fails the stale value keeps being served until the stale window runs out.
+    """
+
+    def __init__(self, fetch_fn, ttl_seconds, stale_seconds, name="cache", clock=time.monotonic):
+        self.fetch_fn = fetch_fn
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._value = None
+        self._fetched_at = None
+        self._inflight = None # threading.Event of the fetch in progress
+        self._inflight_error = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.upstream_calls = 0
+
+    def _usable(self):
+        return self._fetched_at is not None and self._clock() - self._fetched_at < self.ttl_seconds + self.stale_seconds
+
+    def get(self):
+        with self._lock:
+            age = self._clock() - self._fetched_at if self._fetched_at is not None else None
+            if age is not None and age < self.ttl_seconds:
+                self.hits += 1
+                telemetry.count(f"{self.name}.hit")
+                return self._value
+            if self._usable():
+                self.stale_hits += 1
+                telemetry.count(f"{self.name}.stale_hit")
+                if self._inflight is None:
+                    self._inflight = threading.Event()
+                    threading.Thread(target=self._refresh, args=(self._inflight,), daemon=True).start()
+                return self._value
+            self.misses += 1
+            telemetry.count(f"{self.name}.miss")
+            event = self._inflight
+            leader = event is None
+            if leader:
+                event = self._inflight = threading.Event()
+        if leader:
+            self._refresh(event)
+        else:
+            event.wait()
+        with self._lock:
+            if self._usable():
+                return self._value
+            raise self._inflight_error or RuntimeError("Upstream fetch failed")
+
+    def _refresh(self, event):
+        try:
+            value = self.fetch_fn()
+            with self._lock:
+                self._value = value
+                self._fetched_at = self._clock()
+                self._inflight_error = None
+        except Exception as e:
+            print(f"Error refreshing cached data: {e}")
+            with self._lock:
+                self._inflight_error = e
+        finally:
+            with self._lock:
+                self.upstream_calls += 1
+                self._inflight = None
+            event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "upstream_calls": self.upstream_calls,
+            }
+
+def fetch_area_disruptions():
+    """Fetches the full disruption list for Gent from De Lijn (no query filter)."""
+    headers = {
+        "Ocp-Apim-Subscription-Key": DE_LIJN_API_KEY
+    }
+    # IMPORTANT: Verify the correct endpoint and parameters in De Lijn documentation
+    endpoint = f"{DE_LIJN_API_BASE_URL}/disruptions" # Example endpoint
+    params = {
+        "area": "Gent" # Example parameter - Check API docs for filtering by area
+    }
+    print(f"Requesting De Lijn disruptions: {endpoint} with params {params}")
+    with telemetry.span("delijn.upstream", endpoint="disruptions"):
+        response = requests.get(endpoint, headers=headers, params=params, timeout=15) # 15-second timeout
+    response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+    with telemetry.span("transport.parse"):
+        data = response.json()
+    # IMPORTANT: Inspect the actual API response structure from De Lijn documentation
+    # The keys 'interruptions' and 'detours' are illustrative examples.
+    return data.get("interruptions", []) + data.get("detours", [])
+
+DISRUPTION_CACHE = RevalidatingCache(fetch_area_disruptions, DISRUPTIONS_CACHE_TTL_SECONDS, DISRUPTIONS_CACHE_STALE_SECONDS,
+                                     name="transport.disruption_cache")
+
+_FILTER_TOKEN = re.compile(r'\w+')
+# Words that only say what kind of thing the user means, not which one
+_GENERIC_FILTER_WORDS = {"line", "lijn", "lines", "lijnen"}
+
+def disruption_matches_filter(disruption, query_filter):
+    """Local replacement for the upstream 'query' parameter: every filter word must occur in the disruption.
+
+    Short words (like line numbers) must match a whole word; longer ones may match inside a word.
+    """
+    if isinstance(disruption, dict):
+        haystack = " ".join(str(v) for v in disruption.values()).casefold()
+    else:
+        haystack = str(disruption).casefold()
+    words = set(_FILTER_TOKEN.findall(haystack))
+    terms = [t for t in _FILTER_TOKEN.findall(query_filter.casefold()) if t not in _GENERIC_FILTER_WORDS]
+    return all(t in words or (len(t) >= 4 and t in haystack) for t in terms)
+
+def traced(name, handler, request):
+    """Runs a request handler inside a trace (joining the caller's X-Trace-Id) and logs its stage timings."""
+    telemetry.start_trace(request.headers)
+    start = time.perf_counter()
+    response = handler(request)
+    status = response[1] if isinstance(response, tuple) else 200
+    telemetry.record(f"{name}.total", (time.perf_counter() - start) * 1000)
+    payload = response[0] if isinstance(response, tuple) else response
+    telemetry.finish_trace(name, status=status, **record_payload(name, payload))
+    return response
 
 @functions_framework.http
 def get_transport_disruptions(request):
     """HTTP Cloud Function to get transport disruptions from De Lijn API."""
+    return traced("get_transport_disruptions", _get_transport_disruptions, request)
+
+def _get_transport_disruptions(request):
     if not DE_LIJN_API_KEY:
         print("Error: DE_LIJN_API_KEY environment variable not set.")
         return {"status": "error", "error_message": "API key is not configured on the server."}, 500
@@ -22,37 +179,22 @@ def get_transport_disruptions(request):
     elif request_json and 'filter' in request_json:
         query_filter = request_json['filter']
 
-    headers = {
-        "Ocp-Apim-Subscription-Key": DE_LIJN_API_KEY
-    }
-    # IMPORTANT: Verify the correct endpoint and parameters in De Lijn documentation
-    endpoint = f"{DE_LIJN_API_BASE_URL}/disruptions" # Example endpoint
-    params = {
-        "area": "Gent" # Example parameter - Check API docs for filtering by area
-    }
-    if query_filter:
-        # IMPORTANT: Check how the API expects filters (e.g., 'query', 'line', etc.)
-        params['query'] = query_filter # Example parameter
-
     try:
-        print(f"Requesting De Lijn disruptions: {endpoint} with params {params}")
-        response = requests.get(endpoint, headers=headers, params=params, timeout=15) # 15-second timeout
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-
-        data = response.json()
-        # IMPORTANT: Inspect the actual API response structure from De Lijn documentation
-        # The keys 'interruptions' and 'detours' are illustrative examples.
-        disruptions_list = data.get("interruptions", []) + data.get("detours", [])
+        # Full area list from the in-process cache; the filter is applied locally
+        disruptions_list = DISRUPTION_CACHE.get()
+        if query_filter:
+            disruptions_list = [d for d in disruptions_list if disruption_matches_filter(d, query_filter)]
 
         if disruptions_list:
             # IMPORTANT: Adapt formatting based on the actual data fields provided by the API
-            # Example: Extracting 'type' and 'details'
-            formatted_disruptions = [
-                f"{d.get('type', 'Disruption')}: {d.get('details', 'No specific details provided')}" 
-                for d in disruptions_list
-            ]
-            print(f"Found {len(formatted_disruptions)} disruptions.")
-            return { "status": "success", "disruptions": formatted_disruptions }
+            # Example: 'type' and 'details', merged per affected line ('lines') so repeats cost no tokens
+            with telemetry.span("transport.format"):
+                formatted_disruptions, omitted = compact_disruptions(disruptions_list, DISRUPTIONS_MAX_RESULTS)
+            print(f"Found {len(disruptions_list)} disruptions, returning {len(formatted_disruptions)} entries.")
+            response = { "status": "success", "disruptions": formatted_disruptions }
+            if omitted:
+                response["message"] = f"{omitted} more lines are affected; ask about a specific line for details."
+            return response
         else:
             print("No disruptions reported matching the query.")
             message = "No current disruptions reported for Gent."
@@ -88,13 +230,128 @@ def get_transport_disruptions(request):
         print(f"Unexpected error in get_transport_disruptions: {str(e)}")
         return { "status": "error", "error_message": f"An unexpected internal error occurred while fetching disruption data." }, 500
 
+TIMETABLE = None
+timetable_loaded = False
+# Concurrent first requests wait for one load instead of seeing no timetable
+TIMETABLE_LOCK = threading.Lock()
+
+def get_timetable():
+    """Loads the offline GTFS timetable once; None if it has not been built or fails to load."""
+    global TIMETABLE, timetable_loaded
+    if not timetable_loaded:
+        with TIMETABLE_LOCK:
+            if not timetable_loaded:
+                if os.path.isdir(GTFS_TIMETABLE_DIR):
+                    try:
+                        # Imported here so the disruptions function never pays for numpy
+                        from gtfs_timetable import GTFSTimetable
+                        TIMETABLE = GTFSTimetable.load(GTFS_TIMETABLE_DIR)
+                        print(f"Loaded GTFS timetable with {len(TIMETABLE.stop_ids)} stops from {GTFS_TIMETABLE_DIR}")
+                    except Exception as e:
+                        print(f"Error loading GTFS timetable from {GTFS_TIMETABLE_DIR}: {e}")
+                timetable_loaded = True
+    return TIMETABLE
+
+GAZETTEER = None
+gazetteer_loaded = False
+# Like TIMETABLE_LOCK: stop names are not passed through unresolved while the gazetteer builds
+GAZETTEER_LOCK = threading.Lock()
+
+def get_gazetteer():
+    """Builds the stop gazetteer once, from the timetable or else from GTFS_STOPS_PATH; None if neither exists."""
+    global GAZETTEER, gazetteer_loaded
+    if not gazetteer_loaded:
+        with GAZETTEER_LOCK:
+            if not gazetteer_loaded:
+                try:
+                    from stop_gazetteer import StopGazetteer
+                    timetable = get_timetable()
+                    if timetable is not None:
+                        GAZETTEER = StopGazetteer.from_timetable(timetable)
+                    elif os.path.exists(GTFS_STOPS_PATH):
+                        GAZETTEER = StopGazetteer.from_stops_file(GTFS_STOPS_PATH)
+                    if GAZETTEER is not None:
+                        print(f"Built stop gazetteer with {len(GAZETTEER.stop_ids)} stops")
+                except Exception as e:
+                    print(f"Error building stop gazetteer: {e}")
+                gazetteer_loaded = True
+    return GAZETTEER
+
+def resolve_stop(stop_identifier, lat=None, lon=None):
+    """Maps a stop ID, a fuzzy stop name, or coordinates to known stop IDs (empty if unresolved)."""
+    gazetteer = get_gazetteer()
+    if gazetteer is None:
+        return [stop_identifier] if stop_identifier else []
+    if stop_identifier:
+        return gazetteer.resolve(stop_identifier)
+    nearest = gazetteer.nearest(lat, lon, k=1)
+    return [nearest[0][0]] if nearest else []
+
+def local_now():
+    """Current wall-clock time in the timetable's time zone."""
+    try:
+        from zoneinfo import ZoneInfo
+        return datetime.datetime.now(ZoneInfo(SCHEDULE_TIMEZONE)).replace(tzinfo=None)
+    except Exception:
+        return datetime.datetime.now()
+
+def parse_schedule_time(time_query):
+    """'next'/'now'/None -> now, 'HH:MM' -> today at that time; None if the format is not understood."""
+    now = local_now()
+    if not time_query or str(time_query).strip().lower() in ("next", "now"):
+        return now
+    try:
+        parsed = datetime.datetime.strptime(str(time_query).strip(), "%H:%M")
+    except ValueError:
+        return None
+    return now.replace(hour=parsed.hour, minute=parsed.minute, second=0, microsecond=0)
+
+def schedule_from_timetable(stop_ids, line_filter, time_query):
+    """Answers a schedule query from the offline timetable, or returns None to fall back to the live API.
+
+    Departures of all given stops (e.g. the platforms of one named stop) are merged by time.
+    """
+    timetable = get_timetable()
+    stop_ids = [stop_id for stop_id in stop_ids if timetable is not None and stop_id in timetable.stop_index]
+    if not stop_ids:
+        return None
+    when = parse_schedule_time(time_query)
+    if when is None:
+        return None
+    if not timetable.runs_on(when.date()):
+        # An expired (or not yet valid) feed would otherwise answer "no departures" for every stop
+        first, last = timetable.feed_range()
+        print(f"Offline timetable has no service on {when.date():%Y%m%d} (feed covers {first}-{last}), using the live API.")
+        telemetry.count("transport.timetable_no_service")
+        return None
+    departures = []
+    with telemetry.span("transport.timetable"):
+        for stop_id in stop_ids:
+            departures += timetable.next_departures(stop_id, when, line=line_filter, limit=SCHEDULE_MAX_DEPARTURES)
+    departures = sorted(departures, key=lambda d: d[0])[:SCHEDULE_MAX_DEPARTURES]
+    stop_identifier = ", ".join(stop_ids)
+    from gtfs_timetable import format_time # Already loaded by get_timetable()
+    formatted_schedule = [
+        f"Line {line} at {format_time(seconds)} towards {headsign or '?'}"
+        for seconds, line, headsign in departures
+    ]
+    print(f"Found {len(formatted_schedule)} timetable entries for stop {stop_identifier}.")
+    if not formatted_schedule:
+        return { "status": "success", "schedule": [], "source": "timetable", "message": "No scheduled departures found matching your query." }
+    return { "status": "success", "schedule": formatted_schedule, "source": "timetable" }
+
 @functions_framework.http
 def get_transport_schedule(request):
-    """HTTP Cloud Function to get transport schedules from De Lijn API."""
-    if not DE_LIJN_API_KEY:
-        print("Error: DE_LIJN_API_KEY environment variable not set.")
-        return {"status": "error", "error_message": "API key is not configured on the server."}, 500
+    """HTTP Cloud Function to get transport schedules (offline GTFS timetable, or the De Lijn API)."""
+    return traced("get_transport_schedule", _get_transport_schedule, request)
+
+def parse_flag(value):
+    """A boolean request parameter: JSON true/1 or the strings "1", "true", "yes" (anything else is false)."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return value is True or (isinstance(value, int) and value == 1)
 
+def _get_transport_schedule(request):
     request_json = request.get_json(silent=True)
     
     # --- Parameter Extraction --- 
@@ -104,18 +361,56 @@ def get_transport_schedule(request):
     line_filter = None
     time_query = None # e.g., 'next', '14:30'
 
+    realtime = False # Ask De Lijn for live data instead of the static timetable
+    lat = lon = None # Alternative to 'stop': use the nearest stop to these coordinates
+
+    # 'stop_id'/'line_number' are accepted as aliases, they are what the agent's schedule tool sends
     if request.args:
-        stop_identifier = request.args.get('stop') # Example: could be ID or name
-        line_filter = request.args.get('line')
+        stop_identifier = request.args.get('stop') or request.args.get('stop_id') # Example: could be ID or name
+        line_filter = request.args.get('line') or request.args.get('line_number')
         time_query = request.args.get('time')
+        realtime = parse_flag(request.args.get('realtime'))
+        lat, lon = request.args.get('lat'), request.args.get('lon')
     elif request_json:
-        stop_identifier = request_json.get('stop')
-        line_filter = request_json.get('line')
+        stop_identifier = request_json.get('stop') or request_json.get('stop_id')
+        line_filter = request_json.get('line') or request_json.get('line_number')
         time_query = request_json.get('time')
+        realtime = parse_flag(request_json.get('realtime'))
+        lat, lon = request_json.get('lat'), request_json.get('lon')
 
-    if not stop_identifier:
+    if not stop_identifier and (lat is None or lon is None):
         return ("Missing required parameter 'stop' (stop ID or name) in request.", 400)
 
+    # --- Stop Resolution --- 
+    # Names and coordinates are resolved to stop IDs locally before any De Lijn call
+    try:
+        with telemetry.span("transport.stop_resolution"):
+            stop_ids = resolve_stop(stop_identifier, float(lat) if lat is not None else None, float(lon) if lon is not None else None)
+    except (TypeError, ValueError):
+        return ("Parameters 'lat' and 'lon' must be numeric.", 400)
+    if stop_ids:
+        if stop_identifier not in stop_ids:
+            print(f"Resolved stop '{stop_identifier or (lat, lon)}' to {stop_ids}")
+    elif not stop_identifier:
+        return { "status": "success", "schedule": [], "message": "No stop found near the given location." }
+
+    # --- Offline Timetable --- 
+    # Static timetable questions are answered locally; live calls are only needed for realtime data
+    if not realtime:
+        try:
+            offline_response = schedule_from_timetable(stop_ids, line_filter, time_query)
+            if offline_response is not None:
+                return offline_response
+        except Exception as e:
+            print(f"Error answering from the GTFS timetable, falling back to the De Lijn API: {e}")
+
+    if not DE_LIJN_API_KEY:
+        print("Error: DE_LIJN_API_KEY environment variable not set.")
+        return {"status": "error", "error_message": "API key is not configured on the server."}, 500
+
+    if stop_ids:
+        stop_identifier = stop_ids[0] # The live API is asked about the best match only
+
     # --- API Call Construction --- 
     headers = {
         "Ocp-Apim-Subscription-Key": DE_LIJN_API_KEY
@@ -138,9 +433,11 @@ def get_transport_schedule(request):
     # --- API Call and Response Handling --- 
     try:
         print(f"Requesting De Lijn schedule: {endpoint} with params {params}")
-        response = requests.get(endpoint, headers=headers, params=params, timeout=15)
+        with telemetry.span("delijn.upstream", endpoint="schedule"):
+            response = requests.get(endpoint, headers=headers, params=params, timeout=15)
         response.raise_for_status()
-        data = response.json()
+        with telemetry.span("transport.parse"):
+            data = response.json()
 
         # IMPORTANT: Inspect the actual API response structure from De Lijn docs.
         # Extract relevant schedule info (e.g., upcoming departures, times, line numbers)
@@ -148,10 +445,13 @@ def get_transport_schedule(request):
 
         if schedule_info:
              # IMPORTANT: Format the schedule based on the actual data fields.
-            formatted_schedule = [
-                f"Line {dep.get('line', '?')} at {dep.get('time', '?')} towards {dep.get('direction', '?')}" 
-                for dep in schedule_info
-            ] # Example formatting
+            with telemetry.span("transport.format"):
+                now = local_now()
+                schedule_info = rank_departures(schedule_info, SCHEDULE_MAX_DEPARTURES, now.hour * 60 + now.minute)
+                formatted_schedule = [
+                    f"Line {dep.get('line', '?')} at {dep.get('time', '?')} towards {dep.get('direction', '?')}" 
+                    for dep in schedule_info
+                ] # Example formatting
             print(f"Found {len(formatted_schedule)} schedule entries.")
             return { "status": "success", "schedule": formatted_schedule }
         else:
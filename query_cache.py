@@ -0,0 +1,149 @@
+# query_cache.py (in-process caches for repeated queries)
+import asyncio
+import concurrent.futures
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+_EDGE_PUNCTUATION = re.compile(r'^[\s\W_]+|[\s\W_]+$')
+
+def normalize_query(text):
+    """Cache key for a user query: NFC, case-folded, collapsed whitespace, no leading/trailing punctuation."""
+    text = unicodedata.normalize('NFC', str(text)).casefold()
+    text = _WHITESPACE.sub(' ', text)
+    return _EDGE_PUNCTUATION.sub('', text)
+
+class LRUCache:
+    """Thread-safe bounded LRU cache with an optional time-to-live per entry.
+
+    Keeps hit/miss/eviction counters so the cache can be sized from production traffic.
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        expires_at = self._clock() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+class ToolResultCache:
+    """Per-session cache of agent tool results, one TTL-bounded LRUCache per tool.
+
+    Keys are the tool name plus its arguments with None dropped and string values
+    normalized like queries, so "Line 1" and "line 1 " share an entry. Tools without
+    a TTL are never cached. Identical calls made while one is in flight (e.g. twice the
+    same call in one model response) wait for its result instead of calling the tool again.
+    """
+
+    def __init__(self, ttl_seconds, max_size=256, clock=time.monotonic):
+        self._caches = {name: LRUCache(max_size=max_size, ttl_seconds=ttl, clock=clock)
+                        for name, ttl in ttl_seconds.items() if ttl and ttl > 0}
+        # Key -> concurrent.futures.Future of the call in flight; such futures can be awaited
+        # from any event loop, and every turn runs on its own
+        self._in_flight = {}
+        self._shared = dict.fromkeys(self._caches, 0)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(tool_name, arguments):
+        items = []
+        for name, value in sorted(arguments.items()):
+            if value is None:
+                continue
+            items.append((name, normalize_query(value) if isinstance(value, str) else value))
+        return (tool_name, tuple(items))
+
+    def get(self, tool_name, arguments):
+        cache = self._caches.get(tool_name)
+        return cache.get(self.key(tool_name, arguments)) if cache is not None else None
+
+    def put(self, tool_name, arguments, result):
+        cache = self._caches.get(tool_name)
+        if cache is not None:
+            cache.put(self.key(tool_name, arguments), result)
+
+    async def get_or_call(self, tool_name, arguments, call, cacheable=lambda result: True):
+        """Returns (result, source): the cached result ("hit"), the result of an identical call
+        already in flight ("shared"), or that of awaiting call() ("miss"), stored if cacheable."""
+        cache = self._caches.get(tool_name)
+        if cache is None:
+            return await call(), "miss"
+        key = self.key(tool_name, arguments)
+        with self._lock:
+            result = cache.get(key)
+            if result is not None:
+                return result, "hit"
+            pending = self._in_flight.get(key)
+            if pending is not None:
+                self._shared[tool_name] += 1
+            else:
+                self._in_flight[key] = future = concurrent.futures.Future()
+        if pending is not None:
+            return await asyncio.wrap_future(pending), "shared"
+        try:
+            result = await call()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if cacheable(result):
+                cache.put(key, result)
+            del self._in_flight[key]
+        future.set_result(result)
+        return result, "miss"
+
+    def stats(self):
+        with self._lock:
+            shared = dict(self._shared)
+        return {name: {**cache.stats(), "shared": shared[name]} for name, cache in self._caches.items()}
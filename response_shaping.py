@@ -0,0 +1,140 @@
+# response_shaping.py (trims tool responses to what the model needs before they enter its context)
+import json
+import re
+
+import telemetry
+
+# Rough characters per token of the Gemini tokenizer on Dutch and English text
+CHARS_PER_TOKEN = 4
+# Marks text left out between two kept sentences
+ELISION = " … "
+
+# A sentence ends at . ! or ? followed by whitespace, at a line break, or at the end of the text
+_SENTENCE = re.compile(r'\S.*?(?:[.!?](?=\s|$)|(?=\n)|$)', re.S)
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def truncate(text, max_chars):
+    """Cuts text to at most max_chars at a word boundary, marking the cut with '…'."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max(0, max_chars - 1)]
+    if ' ' in cut:
+        cut = cut[:cut.rindex(' ')]
+    return cut.rstrip() + "…"
+
+def relevant_spans(text, query, max_chars):
+    """The sentences of text that share the most terms with query, in reading order, within max_chars.
+
+    Text that already fits is returned unchanged. A sentence right after a matching one
+    gets a small score too (it often carries the answer, e.g. "It opens at 9:00.").
+    Sentences sharing nothing with the query are dropped.
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    from lexical_index import tokenize # Only the RAG function shapes passages; keeps numpy out of the others
+
+    query_terms = set(tokenize(query))
+    sentences = [(m.start(), m.end()) for m in _SENTENCE.finditer(text)]
+    overlaps = [len(query_terms.intersection(tokenize(text[start:end]))) for start, end in sentences]
+    scores = [overlap + (0.5 if i and overlaps[i - 1] else 0) for i, overlap in enumerate(overlaps)]
+    ranked = sorted((i for i in range(len(sentences)) if scores[i] > 0), key=lambda i: (-scores[i], i))
+    if not ranked:
+        # Nothing matches: the opening of the passage is the best summary there is
+        return truncate(text, max_chars)
+    start, end = sentences[ranked[0]]
+    if end - start > max_chars:
+        # Even the best sentence alone is over budget: better cut than replaced by a weaker one
+        return truncate(text[start:end], max_chars)
+    kept, used = [ranked[0]], end - start
+    for i in ranked[1:]:
+        start, end = sentences[i]
+        length = len(ELISION) + end - start
+        if used + length <= max_chars:
+            kept.append(i)
+            used += length
+    kept.sort()
+    shaped = text[sentences[kept[0]][0]:sentences[kept[0]][1]]
+    for previous, i in zip(kept, kept[1:]):
+        shaped += (" " if i == previous + 1 else ELISION) + text[sentences[i][0]:sentences[i][1]]
+    return shaped
+
+def shape_passages(texts, query, max_chars):
+    """Applies relevant_spans to ranked passages under one shared budget.
+
+    The best passage may use half of it (all of it when it is the only one); the rest is
+    split over the others, and whatever a passage leaves unused carries over to the next.
+    """
+    if max_chars <= 0:
+        return list(texts)
+    shaped, remaining = [], max_chars
+    for i, text in enumerate(texts):
+        left = len(texts) - i
+        budget = remaining if left == 1 else (remaining // 2 if i == 0 else remaining // left)
+        span = relevant_spans(text, query, budget)
+        shaped.append(span)
+        remaining = max(0, remaining - len(span))
+    return shaped
+
+def disruption_text(disruption):
+    if isinstance(disruption, dict):
+        return f"{disruption.get('type', 'Disruption')}: {disruption.get('details', 'No specific details provided')}"
+    return str(disruption)
+
+def disruption_line(disruption):
+    """The line(s) a disruption affects as one string, or None if the record does not say."""
+    if not isinstance(disruption, dict):
+        return None
+    lines = disruption.get('lines') or disruption.get('line')
+    if isinstance(lines, (list, tuple)):
+        lines = ", ".join(str(line) for line in lines)
+    lines = str(lines).strip() if lines else ""
+    return lines or None
+
+def compact_disruptions(disruptions, max_items):
+    """One entry per line with its distinct disruption texts, lines in the order first seen.
+
+    Disruptions without a line are only deduplicated by text. Returns (entries, omitted),
+    where omitted counts the entries beyond max_items (0 or less keeps them all).
+    """
+    grouped = {}
+    for disruption in disruptions:
+        text = disruption_text(disruption)
+        line = disruption_line(disruption)
+        texts = grouped.setdefault(line or text, (line, []))[1]
+        if text not in texts:
+            texts.append(text)
+    entries = [f"Line {line}: {'; '.join(texts)}" if line else texts[0] for line, texts in grouped.values()]
+    if max_items > 0 and len(entries) > max_items:
+        return entries[:max_items], len(entries) - max_items
+    return entries, 0
+
+def departure_minutes(value, now_minutes=0):
+    """Minutes after now_minutes of an 'HH:MM' time (wrapping past midnight), or None if it does not parse."""
+    match = re.match(r'^\s*(\d{1,2}):(\d{2})', str(value or ''))
+    if not match:
+        return None
+    return (int(match.group(1)) * 60 + int(match.group(2)) - now_minutes) % (24 * 60)
+
+def rank_departures(departures, max_items, now_minutes=0):
+    """Departures sorted by how soon they leave (times that do not parse last), capped at max_items."""
+    def soonest(departure):
+        minutes = departure_minutes(departure.get('time') if isinstance(departure, dict) else None, now_minutes)
+        return (minutes is None, minutes or 0)
+    ranked = sorted(departures, key=soonest)
+    return ranked[:max_items] if max_items > 0 else ranked
+
+def payload_size(payload):
+    """(bytes, estimated tokens) of a response as the compact JSON the agent receives."""
+    text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str)
+    return len(text.encode('utf-8')), estimate_tokens(text)
+
+def record_payload(name, payload):
+    """Counts a response under '<name>.responses', '.payload_bytes' and '.payload_tokens' and
+    returns the same numbers for the request's log line."""
+    size, tokens = payload_size(payload)
+    telemetry.count(f"{name}.responses")
+    telemetry.count(f"{name}.payload_bytes", size)
+    telemetry.count(f"{name}.payload_tokens", tokens)
+    return {"payload_bytes": size, "payload_tokens": tokens}
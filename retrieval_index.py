@@ -0,0 +1,236 @@
+# retrieval_index.py (vector search backends for main_rag.py)
+import hashlib
+
+import numpy as np
+
+INDEX_FORMAT_VERSION = 1
+
+def normalize_vector(vec):
+    """Returns the embedding as a float32 unit vector (or all zeros if its norm is 0)."""
+    v = np.asarray(vec.values if hasattr(vec, 'values') else vec, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+def select_top_k(ids, scores, k, threshold=None):
+    """Picks the k best (id, score) pairs with argpartition, sorted by descending score."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return []
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+    return [(int(ids[i]), float(scores[i])) for i in candidates if threshold is None or scores[i] >= threshold]
+
+def top_k_similar(query_vec, matrix, k, threshold=None):
+    """Scores all rows of a normalized matrix against a query in one matrix-vector product.
+
+    Returns a list of (index, score) tuples sorted by descending score, limited to k
+    entries and to scores >= threshold when a threshold is given.
+    """
+    if matrix is None or matrix.shape[0] == 0 or k <= 0:
+        return []
+    scores = matrix @ normalize_vector(query_vec)
+    return select_top_k(np.arange(scores.shape[0]), scores, k, threshold)
+
+def keys_fingerprint(keys):
+    """Hash of the ordered row keys, used to detect an index built for a different matrix."""
+    digest = hashlib.sha256()
+    for key in keys:
+        digest.update(key.encode('utf-8'))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+class ExactIndex:
+    """Brute-force cosine search over the full normalized matrix."""
+    kind = "exact"
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def search(self, query_vec, k, threshold=None):
+        return top_k_similar(query_vec, self.matrix, k, threshold)
+
+    def scores(self, query_vec, rows):
+        """Cosine similarity of the query to the given rows."""
+        return self.matrix[np.asarray(rows)] @ normalize_vector(query_vec)
+
+def quantize_int8(matrix, chunk_size=65536):
+    """Symmetric per-row int8 quantization: row ~= codes * scale, with scale = max|row| / 127.
+
+    Returns (codes, scales): an (n, dim) int8 matrix and n float32 scales. Works on
+    chunks so a memory-mapped float32 matrix is never loaded whole.
+    """
+    n, dim = matrix.shape
+    codes = np.empty((n, dim), dtype=np.int8)
+    scales = np.empty(n, dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        block = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+        peak = np.abs(block).max(axis=1) if dim else np.zeros(block.shape[0], dtype=np.float32)
+        scale = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        codes[start:start + chunk_size] = np.rint(block / scale[:, None]).astype(np.int8)
+        scales[start:start + chunk_size] = scale
+    return codes, scales
+
+class Int8ExactIndex:
+    """Brute-force search over int8-quantized rows: 1 byte per dimension (plus a 4-byte
+    scale per row) instead of 4, at the cost of a small score error (see
+    benchmarks/bench_doc_store.py). Rows are dequantized in small blocks that stay in
+    the CPU cache, which keeps scoring about as fast as the float32 matrix product.
+    """
+    kind = "exact-int8"
+
+    def __init__(self, codes, scales, chunk_size=256):
+        self.codes = codes
+        self.scales = scales
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        return cls(*quantize_int8(matrix))
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def dequantize(self, rows):
+        """Approximate float32 vectors of the given rows."""
+        rows = np.asarray(rows)
+        return self.codes[rows].astype(np.float32) * self.scales[rows, None]
+
+    def search(self, query_vec, k, threshold=None):
+        n = self.codes.shape[0]
+        if n == 0 or k <= 0:
+            return []
+        query = normalize_vector(query_vec)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, self.chunk_size):
+            scores[start:start + self.chunk_size] = self.codes[start:start + self.chunk_size].astype(np.float32) @ query
+        scores *= self.scales
+        return select_top_k(np.arange(n), scores, k, threshold)
+
+    def scores(self, query_vec, rows):
+        """Cosine similarity of the query to the given rows (as search() computes it)."""
+        return self.dequantize(rows) @ normalize_vector(query_vec)
+
+class IVFIndex:
+    """Inverted-file approximate index: rows are grouped by their nearest k-means centroid.
+
+    A query is scored against the centroids first and only the rows of the n_probe
+    closest lists are scanned exactly. n_lists and n_probe trade recall for latency:
+    scanning n_probe / n_lists of the corpus on average.
+    """
+    kind = "ivf"
+
+    def __init__(self, matrix, centroids, list_offsets, list_ids, n_probe=8):
+        self.matrix = matrix
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.n_probe = n_probe
+
+    @classmethod
+    def build(cls, matrix, n_lists=None, n_iter=10, train_size=None, n_probe=8, seed=0, chunk_size=65536):
+        """Trains spherical k-means centroids on (a sample of) the matrix and assigns every row to a list."""
+        n = matrix.shape[0]
+        if n == 0:
+            raise ValueError("Cannot build an IVF index over an empty matrix")
+        n_lists = max(1, min(n_lists or int(np.sqrt(n)), n))
+        rng = np.random.default_rng(seed)
+        train_size = min(n, train_size or max(256 * n_lists, 10000))
+        train = np.asarray(matrix[np.sort(rng.choice(n, size=train_size, replace=False))], dtype=np.float32)
+
+        centroids = train[rng.choice(train_size, size=n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            if empty.any():
+                # Re-seed empty lists with random training rows
+                sums[empty] = train[rng.choice(train_size, size=int(empty.sum()), replace=False)]
+                norms[empty] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        assignments = np.empty(n, dtype=np.int32)
+        for start in range(0, n, chunk_size):
+            block = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+            assignments[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+        return cls._from_assignments(matrix, centroids, assignments, n_probe)
+
+    @classmethod
+    def _from_assignments(cls, matrix, centroids, assignments, n_probe):
+        n_lists = centroids.shape[0]
+        list_ids = np.argsort(assignments, kind='stable').astype(np.int64)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        return cls(matrix, centroids, list_offsets, list_ids, n_probe=n_probe)
+
+    def update(self, matrix, previous_rows):
+        """Returns the index for a changed matrix without retraining the centroids.
+
+        Row i of matrix was row previous_rows[i] of the current one (-1 if it is new): kept
+        rows stay in their list, new rows join the list of their nearest centroid and rows
+        that are gone drop out. Recall slowly degrades as the data drifts from the centroids,
+        so rebuild after large changes.
+        """
+        previous_rows = np.asarray(previous_rows, dtype=np.int64)
+        lists = np.empty(self.list_ids.shape[0], dtype=np.int32)
+        lists[self.list_ids] = np.repeat(np.arange(self.centroids.shape[0], dtype=np.int32), np.diff(self.list_offsets))
+        assignments = np.empty(previous_rows.shape[0], dtype=np.int32)
+        kept = previous_rows >= 0
+        assignments[kept] = lists[previous_rows[kept]]
+        new = np.nonzero(~kept)[0]
+        if new.size:
+            assignments[new] = np.argmax(np.asarray(matrix[new], dtype=np.float32) @ self.centroids.T, axis=1)
+        return self._from_assignments(matrix, self.centroids, assignments, self.n_probe)
+
+    def search(self, query_vec, k, threshold=None, n_probe=None):
+        if self.matrix is None or self.matrix.shape[0] == 0 or k <= 0:
+            return []
+        q = normalize_vector(query_vec)
+        n_probe = min(n_probe or self.n_probe, self.centroids.shape[0])
+        centroid_scores = self.centroids @ q
+        if n_probe < centroid_scores.shape[0]:
+            probe = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        else:
+            probe = np.arange(centroid_scores.shape[0])
+        ids = np.concatenate([self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe])
+        if ids.shape[0] == 0:
+            return []
+        ids.sort() # Sorted gather is friendlier to a memory-mapped matrix
+        return select_top_k(ids, self.matrix[ids] @ q, k, threshold)
+
+    def scores(self, query_vec, rows):
+        """Cosine similarity of the query to the given rows, whichever list they are in."""
+        return self.matrix[np.asarray(rows)] @ normalize_vector(query_vec)
+
+    def save(self, path, fingerprint):
+        """Serializes the index structure (not the vectors) to an .npz file."""
+        with open(path, 'wb') as f:
+            np.savez(f, version=INDEX_FORMAT_VERSION, fingerprint=fingerprint, centroids=self.centroids,
+                     list_offsets=self.list_offsets, list_ids=self.list_ids)
+
+    @classmethod
+    def load(cls, path, matrix, fingerprint, n_probe=8):
+        """Loads an index saved with save(); returns None if it is missing or was built for other data."""
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != INDEX_FORMAT_VERSION or str(data['fingerprint']) != fingerprint:
+                    print(f"IVF index at {path} does not match the current knowledge base, ignoring it.")
+                    return None
+                if int(data['list_offsets'][-1]) != matrix.shape[0]:
+                    print(f"IVF index at {path} has the wrong number of rows, ignoring it.")
+                    return None
+                return cls(matrix, data['centroids'], data['list_offsets'], data['list_ids'], n_probe=n_probe)
+        except FileNotFoundError:
+            print(f"No IVF index found at {path}")
+            return None
+        except Exception as e:
+            print(f"Error loading IVF index from {path}: {e}")
+            return None
@@ -0,0 +1,98 @@
+# semantic_cache.py (answers of recent queries, looked up by embedding similarity, for main_rag.py)
+import threading
+import time
+
+import numpy as np
+
+class SemanticCache:
+    """Thread-safe bounded cache that maps a query embedding to the answer of the most similar
+    recent query, when their cosine similarity reaches threshold.
+
+    Embeddings are kept normalized in one preallocated float32 matrix (max_size x dim), so a
+    lookup is a single matrix-vector product. Each entry also has a scope (e.g. KB version and
+    request options); only entries with an equal scope can match. When full, the least recently
+    used entry is replaced; entries expire after ttl_seconds if set.
+    """
+
+    def __init__(self, max_size=512, threshold=0.95, ttl_seconds=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._vectors = None # allocated on the first put, when the dimension is known
+        self._scopes = [None] * max(max_size, 0)
+        self._values = [None] * max(max_size, 0)
+        self._expires_at = np.full(max(max_size, 0), np.inf)
+        self._last_used = np.zeros(max(max_size, 0), dtype=np.int64)
+        self._size = 0
+        self._tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hit_similarity = 0.0
+
+    def get(self, query_vec, scope):
+        """The answer stored for the most similar query with the same scope, or None."""
+        with self._lock:
+            if self._size:
+                similarities = self._vectors[:self._size] @ np.asarray(query_vec, dtype=np.float32)
+                candidates = np.flatnonzero(similarities >= self.threshold)
+                now = self._clock()
+                for slot in candidates[np.argsort(-similarities[candidates])]:
+                    if self._scopes[slot] == scope and self._expires_at[slot] > now:
+                        self._tick += 1
+                        self._last_used[slot] = self._tick
+                        self.hits += 1
+                        self._hit_similarity += float(similarities[slot])
+                        return self._values[slot]
+            self.misses += 1
+            return None
+
+    def put(self, query_vec, scope, value):
+        if self.max_size <= 0:
+            return
+        query_vec = np.asarray(query_vec, dtype=np.float32)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != query_vec.shape[0]:
+                self._vectors = np.zeros((self.max_size, query_vec.shape[0]), dtype=np.float32)
+                self._size = 0
+            if self._size < self.max_size:
+                slot = self._size
+                self._size += 1
+            else:
+                # Expired entries go first, then the least recently used one
+                expired = self._expires_at <= self._clock()
+                slot = int(np.argmin(np.where(expired, -1, self._last_used)))
+                if not expired[slot]:
+                    self.evictions += 1
+            self._tick += 1
+            self._vectors[slot] = query_vec
+            self._scopes[slot] = scope
+            self._values[slot] = value
+            self._expires_at[slot] = self._clock() + self.ttl_seconds if self.ttl_seconds else np.inf
+            self._last_used[slot] = self._tick
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+            self._scopes = [None] * len(self._scopes)
+            self._values = [None] * len(self._values)
+
+    def __len__(self):
+        return self._size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                # How close paraphrases that hit actually were, for tuning the threshold
+                "mean_hit_similarity": round(self._hit_similarity / self.hits, 4) if self.hits else None,
+            }
@@ -0,0 +1,165 @@
+# stop_gazetteer.py (stop name and coordinate resolution for main_transport.py)
+import csv
+import math
+import re
+import unicodedata
+
+import numpy as np
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+# Grid cell size in degrees (~0.5 km north-south in Flanders)
+GRID_CELL_DEGREES = 0.005
+EARTH_RADIUS_METERS = 6371000.0
+
+def normalize_stop_name(name):
+    """Accent-insensitive, lowercase, punctuation-free form: 'Gent Sint-Pieters' -> 'gent sint pieters'."""
+    decomposed = unicodedata.normalize('NFKD', str(name).casefold())
+    folded = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(' ', folded).strip()
+
+def trigrams(normalized):
+    """Character trigrams of each space-padded word, plus of the name with spaces removed
+    so 'pieters station' still overlaps with 'pietersstation'."""
+    grams = set()
+    for text in normalized.split() + [normalized.replace(' ', '')]:
+        padded = f" {text} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(a))
+
+class StopGazetteer:
+    """In-memory stop index: exact IDs, trigram name search with word-prefix reranking, and a spatial grid.
+
+    Built once from the stop list; name lookups touch only the postings of the query's
+    trigrams, and nearest-stop lookups only the grid cells around the coordinate.
+    """
+
+    def __init__(self, stop_ids, stop_names, stop_lat=None, stop_lon=None):
+        self.stop_ids = list(stop_ids)
+        self.stop_names = list(stop_names)
+        self.id_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        self.name_tokens = [normalize_stop_name(name).split() for name in self.stop_names]
+
+        postings = {}
+        self.trigram_counts = np.zeros(len(self.stop_ids), dtype=np.int32)
+        for i, tokens in enumerate(self.name_tokens):
+            grams = trigrams(' '.join(tokens))
+            self.trigram_counts[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+        self.stop_lat = np.asarray(stop_lat, dtype=np.float64) if stop_lat is not None else None
+        self.stop_lon = np.asarray(stop_lon, dtype=np.float64) if stop_lon is not None else None
+        self.grid = {}
+        if self.stop_lat is not None:
+            for i, (lat, lon) in enumerate(zip(self.stop_lat, self.stop_lon)):
+                if lat or lon:
+                    self.grid.setdefault(self._cell(lat, lon), []).append(i)
+
+    @classmethod
+    def from_timetable(cls, timetable):
+        return cls(timetable.stop_ids, timetable.stop_names, timetable.stop_lat, timetable.stop_lon)
+
+    @classmethod
+    def from_stops_file(cls, path):
+        """Builds the gazetteer from a GTFS stops.txt file."""
+        stop_ids, stop_names, stop_lat, stop_lon = [], [], [], []
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                stop_ids.append(row['stop_id'])
+                stop_names.append(row.get('stop_name', ''))
+                stop_lat.append(float(row.get('stop_lat') or 0))
+                stop_lon.append(float(row.get('stop_lon') or 0))
+        return cls(stop_ids, stop_names, stop_lat, stop_lon)
+
+    def _cell(self, lat, lon):
+        return (int(math.floor(lat / GRID_CELL_DEGREES)), int(math.floor(lon / GRID_CELL_DEGREES)))
+
+    def search(self, query, limit=5, min_score=0.5):
+        """Ranks stops by name similarity. Returns [(stop_id, stop_name, score)], best first.
+
+        Score mixes how much of the query's trigrams the name contains with a Dice
+        overlap (which prefers shorter names), plus a bonus when every query token is
+        a prefix of a token in the name.
+        """
+        normalized = normalize_stop_name(query)
+        if not normalized or not self.stop_ids:
+            return []
+        # Trigrams shared by a large part of the network (e.g. from 'gent') carry little signal
+        # and dominate the cost, so they are skipped whenever the query has rarer ones
+        common_limit = max(1000, len(self.stop_ids) // 10)
+        query_grams = trigrams(normalized)
+        n_grams = len(query_grams)
+        postings = [self.postings[gram] for gram in query_grams if gram in self.postings]
+        rare = [ids for ids in postings if ids.shape[0] <= common_limit]
+        if rare and len(rare) < len(postings):
+            n_grams -= len(postings) - len(rare)
+            postings = rare
+        if not postings:
+            return []
+        candidates, overlap = np.unique(np.concatenate(postings), return_counts=True)
+        containment = overlap / n_grams
+        dice = 2 * overlap / (n_grams + self.trigram_counts[candidates])
+        scores = 0.7 * containment + 0.3 * dice
+
+        # Rerank the best trigram candidates: bonus when every query word starts a word of the name
+        shortlist = min(scores.shape[0], max(limit * 10, 50))
+        top = np.argpartition(-scores, shortlist - 1)[:shortlist] if shortlist < scores.shape[0] else np.arange(scores.shape[0])
+        query_tokens = normalized.split()
+        ranked = []
+        for i in top:
+            tokens = self.name_tokens[candidates[i]]
+            score = float(scores[i])
+            if all(any(t.startswith(q) for t in tokens) for q in query_tokens):
+                score += 0.1
+            ranked.append((score, int(candidates[i])))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        return [(self.stop_ids[stop], self.stop_names[stop], round(score, 4))
+                for score, stop in ranked[:limit] if score >= min_score]
+
+    def resolve(self, stop, min_score=0.5, tie_margin=0.02, max_stops=4):
+        """Turns a stop ID or name into stop IDs.
+
+        Exact IDs resolve to themselves. For names, every stop scoring within tie_margin
+        of the best match is returned, so 'Korenmarkt' covers all of its platforms.
+        """
+        stop = str(stop).strip()
+        if stop in self.id_index:
+            return [stop]
+        matches = self.search(stop, limit=max_stops, min_score=min_score)
+        if not matches:
+            return []
+        best = matches[0][2]
+        return [stop_id for stop_id, _, score in matches if score >= best - tie_margin]
+
+    def nearest(self, lat, lon, k=1, max_meters=2000):
+        """Up to k closest stops within max_meters: [(stop_id, stop_name, distance_m)], nearest first."""
+        if not self.grid:
+            return []
+        row, col = self._cell(lat, lon)
+        # One cell is at least ~350 m wide in Flanders (longitude cells are narrowest)
+        max_ring = int(math.ceil(max_meters / 350.0))
+        found = []
+        for ring in range(max_ring + 1):
+            for r in range(row - ring, row + ring + 1):
+                for c in range(col - ring, col + ring + 1):
+                    if max(abs(r - row), abs(c - col)) == ring:
+                        found.extend(self.grid.get((r, c), []))
+            # Stops outside the searched square are at least ring cells away
+            if len(found) >= k and ring > 0:
+                ids = np.asarray(found)
+                distances = haversine_meters(lat, lon, self.stop_lat[ids], self.stop_lon[ids])
+                if np.sort(distances)[k - 1] <= ring * 350.0:
+                    break
+        if not found:
+            return []
+        ids = np.asarray(found)
+        distances = haversine_meters(lat, lon, self.stop_lat[ids], self.stop_lon[ids])
+        order = np.argsort(distances)[:k]
+        return [(self.stop_ids[ids[i]], self.stop_names[ids[i]], round(float(distances[i]), 1))
+                for i in order if distances[i] <= max_meters]
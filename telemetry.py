@@ -0,0 +1,118 @@
+# telemetry.py (per-stage latency metrics, counters and structured logs shared by all entry points)
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# Header carrying the trace ID from agent tool calls into the Cloud Functions
+TRACE_HEADER = "X-Trace-Id"
+# Recent durations kept per stage for percentiles
+RESERVOIR_SIZE = int(os.environ.get("TELEMETRY_RESERVOIR_SIZE", "2048"))
+# Export spans through OpenTelemetry as well (requires opentelemetry-api and a configured SDK)
+OTEL_ENABLED = os.environ.get("TELEMETRY_OTEL", "false").lower() in ("1", "true", "yes")
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+_TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$')
+
+_lock = threading.Lock()
+_durations = {}
+_counters = {}
+_tracer = None
+
+def _otel_tracer():
+    global _tracer
+    if _tracer is None and OTEL_ENABLED:
+        try:
+            from opentelemetry import trace
+            _tracer = trace.get_tracer("gent-city-assistant")
+        except ImportError:
+            print("TELEMETRY_OTEL is set but opentelemetry is not installed; exporting JSON logs only.")
+    return _tracer
+
+def log_json(**fields):
+    """Writes one structured log line (Cloud Logging parses JSON written to stdout)."""
+    fields.setdefault("severity", "INFO")
+    # One write per line, so lines from concurrent threads do not interleave
+    print(json.dumps(fields, default=str) + "\n", end="", flush=True)
+
+def current_trace_id():
+    return _trace_id.get()
+
+def trace_headers():
+    """Headers to send on outgoing tool calls so the callee joins the same trace."""
+    trace_id = _trace_id.get()
+    return {TRACE_HEADER: trace_id} if trace_id else {}
+
+def start_trace(headers=None):
+    """Starts a request scope, reusing the caller's trace ID (X-Trace-Id or W3C traceparent) if present."""
+    trace_id = None
+    if headers is not None:
+        trace_id = headers.get(TRACE_HEADER)
+        if not trace_id:
+            match = _TRACEPARENT.match(headers.get("traceparent", "") or "")
+            trace_id = match.group(1) if match else None
+    trace_id = trace_id or uuid.uuid4().hex
+    _trace_id.set(trace_id)
+    _request_stages.set({})
+    return trace_id
+
+def finish_trace(name, **fields):
+    """Ends the request scope with one JSON log line holding every stage timing of the request."""
+    stages = _request_stages.get() or {}
+    log_json(message=f"{name} finished", event=name, trace_id=_trace_id.get(),
+             stages_ms={stage: round(ms, 3) for stage, ms in stages.items()}, **fields)
+    _request_stages.set(None)
+
+def record(stage, duration_ms):
+    """Adds a stage duration to the process-wide reservoir and to the current request."""
+    with _lock:
+        reservoir = _durations.get(stage)
+        if reservoir is None:
+            reservoir = _durations[stage] = deque(maxlen=RESERVOIR_SIZE)
+        reservoir.append(duration_ms)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + duration_ms
+
+@contextmanager
+def span(stage, **attributes):
+    """Times a block as one stage, e.g. `with span("rag.embedding"): ...`."""
+    tracer = _otel_tracer()
+    otel_span = tracer.start_as_current_span(stage, attributes=attributes) if tracer is not None else None
+    if otel_span is not None:
+        otel_span.__enter__()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, (time.perf_counter() - start) * 1000)
+        if otel_span is not None:
+            otel_span.__exit__(None, None, None)
+
+def count(name, value=1):
+    """Increments a process-wide counter (cache hits, upstream calls, ...)."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def snapshot():
+    """Counters plus p50/p95/p99 (ms) of the recent durations of every stage."""
+    with _lock:
+        durations = {stage: sorted(values) for stage, values in _durations.items()}
+        counters = dict(_counters)
+
+    def percentile(values, q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+    return {
+        "stages": {
+            stage: {"count": len(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95), "p99": percentile(values, 0.99)}
+            for stage, values in durations.items() if values
+        },
+        "counters": counters,
+    }
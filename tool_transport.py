@@ -0,0 +1,179 @@
+# tool_transport.py (shared HTTP transport for the agent's Cloud Function tools)
+import asyncio
+import random
+import threading
+import time
+
+import httpx
+
+import telemetry
+from response_shaping import estimate_tokens
+
+# Status codes worth retrying: rate limiting and transient server/gateway errors
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without contacting the endpoint while its circuit breaker is open."""
+
+class CircuitBreaker:
+    """Stops calling an endpoint after consecutive failures, then lets one trial call through after a cool-down."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if self._clock() - self._opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+
+class ToolTransport:
+    """Keep-alive connection pool plus retry, backoff and circuit breaking for tool endpoints.
+
+    apost() can be awaited from any event loop: the request itself runs on one long-lived
+    loop in a background thread that owns a single process-wide httpx.AsyncClient, so
+    connections are kept alive across turns (the agent runs each turn on a new loop). It
+    retries connection errors, timeouts and 429/5xx responses with jittered exponential
+    backoff (honouring Retry-After), and returns the final response for the caller to check.
+    """
+
+    def __init__(self, timeouts=None, default_timeout=20.0, max_retries=2, backoff_base=0.25,
+                 backoff_max=4.0, pool_size=10, failure_threshold=5, reset_timeout=30.0):
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.pool_size = pool_size
+        # The I/O loop, its thread and the shared client; started on first use (see _io)
+        self._io_loop = None
+        self._io_thread = None
+        self._client = None
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url):
+        with self._lock:
+            if url not in self._breakers:
+                self._breakers[url] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[url]
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _check_breaker(self, url):
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {url}: too many recent failures, not calling it for now")
+        return breaker
+
+    async def apost(self, url, payload, timeout=None, name="tool"):
+        """POSTs JSON with retries; returns the last httpx.Response.
+
+        The current trace ID is forwarded, the round trip is timed as stage 'agent.<name>' and
+        the size of what comes back is counted (see record_response).
+        """
+        # Trace headers come from the caller's context, the I/O loop's tasks have their own
+        headers = telemetry.trace_headers()
+        with telemetry.span(f"agent.{name}"):
+            # Cancelling the caller cancels the request on the I/O loop as well
+            loop, client = self._io()
+            response = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+                self._apost(client, url, payload, timeout, headers), loop))
+        self.record_response(name, response)
+        return response
+
+    def _io(self):
+        """The I/O event loop and its client, started with the loop's thread on first use."""
+        with self._lock:
+            if self._io_loop is None:
+                loop = asyncio.new_event_loop()
+                limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+                self._client = httpx.AsyncClient(limits=limits)
+                self._io_thread = threading.Thread(target=loop.run_forever, name="tool-transport-io", daemon=True)
+                self._io_thread.start()
+                self._io_loop = loop
+            return self._io_loop, self._client
+
+    async def _apost(self, client, url, payload, timeout, headers):
+        breaker = self._check_breaker(url)
+        timeout = timeout or self.timeouts.get(url, self.default_timeout)
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await client.post(url, json=payload, timeout=timeout, headers=headers)
+                except (httpx.TransportError, httpx.TimeoutException):
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff(attempt, response.headers.get("Retry-After")))
+                    continue
+                self._record_status(breaker, response.status_code)
+                return response
+        except BaseException:
+            # Includes cancellation: a half-open trial must always end in a success or a failure
+            breaker.record_failure()
+            raise
+
+    def record_response(self, name, response):
+        """Counts the bytes and estimated tokens a tool call hands the model ('agent.<name>.payload_*')."""
+        telemetry.count(f"agent.{name}.calls")
+        telemetry.count(f"agent.{name}.payload_bytes", len(response.content))
+        telemetry.count(f"agent.{name}.payload_tokens", estimate_tokens(response.text))
+
+    def _record_status(self, breaker, status_code):
+        # Only server-side trouble counts against the endpoint; 4xx are caller errors
+        if status_code in RETRYABLE_STATUS_CODES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def close(self):
+        """Closes the shared client and stops the I/O loop (a later call starts a new one)."""
+        with self._lock:
+            loop, thread, client = self._io_loop, self._io_thread, self._client
+            self._io_loop = self._io_thread = self._client = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()